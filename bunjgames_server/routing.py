@@ -1,12 +1,16 @@
 from channels.routing import ProtocolTypeRouter, URLRouter
+from django.core.asgi import get_asgi_application
 from django.urls import path
 
+from common.media import MediaRouter
+from common.reaper import reaper
 import jeopardy.urls
 import weakest.urls
 import whirligig.urls
 import feud.urls
 
 application = ProtocolTypeRouter({
+    'http': MediaRouter(get_asgi_application()),
     'websocket': URLRouter([
         path('whirligig/ws/', URLRouter(whirligig.urls.websocket_urlpatterns)),
         path('jeopardy/ws/', URLRouter(jeopardy.urls.websocket_urlpatterns)),
@@ -14,3 +18,6 @@ application = ProtocolTypeRouter({
         path('feud/ws/', URLRouter(feud.urls.websocket_urlpatterns)),
     ]),
 })
+
+# every server loads the routing, runserver does not go through asgi.py
+reaper.start()
@@ -64,6 +64,14 @@ CHANNEL_LAYERS = {
     }
 }
 
+if os.environ.get('BUNJGAMES_BROKER'):
+    CHANNEL_LAYERS['default'] = {
+        'BACKEND': 'common.layers.BrokerChannelLayer',
+        'CONFIG': {
+            'address': os.environ['BUNJGAMES_BROKER'],
+        },
+    }
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2',
@@ -129,6 +137,37 @@ MEDIA_ROOT_WHIRLIGIG = os.path.join(BASE_DIR, 'media', 'whirligig')
 MEDIA_ROOT_JEOPARDY = os.path.join(BASE_DIR, 'media', 'jeopardy')
 MEDIA_ROOT_WEAKEST = os.path.join(BASE_DIR, 'media', 'weakest')
 MEDIA_ROOT_FEUD = os.path.join(BASE_DIR, 'media', 'feud')
+MEDIA_ROOT_BLOBS = os.path.join(BASE_DIR, 'media', 'blobs')
+MEDIA_ROOT_PACKS = os.path.join(BASE_DIR, 'media', 'packs')
+MEDIA_ROOT_RENDITIONS = os.path.join(BASE_DIR, 'media', 'renditions')
+MEDIA_MAX_AGE = 365 * 24 * 60 * 60
+MEDIA_ACCEL_REDIRECT = os.environ.get('BUNJGAMES_MEDIA_ACCEL_REDIRECT')  # e.g. /protected-media/
 MEDIA_URL = '/media/'
 
 JEOPARDY_IS_POST_EVENT_REQUIRED = False
+
+GAMES_EXECUTOR_WORKERS = int(os.environ.get('BUNJGAMES_EXECUTOR_WORKERS', '8'))
+GAMES_SNAPSHOTS_CACHE_SIZE = 1024
+GAMES_MANIFESTS_CACHE_SIZE = 1024
+GAMES_ENGINE_ENABLED = os.environ.get('BUNJGAMES_ENGINE', 'False').lower() != 'false'
+GAMES_ENGINE_FLUSH_INTERVAL = 0.5
+GAMES_ENGINE_BATCH_SIZE = 500
+GAMES_ENGINE_IDLE_TIME = 15 * 60
+GAMES_OUTBOX_LIMIT = int(os.environ.get('BUNJGAMES_OUTBOX_LIMIT', '256'))  # queued messages before a client is dropped
+GAMES_ACK_WINDOW = int(os.environ.get('BUNJGAMES_ACK_WINDOW', '4'))  # unacknowledged snapshots before sending waits
+GAMES_BROADCAST_WINDOW = float(os.environ.get('BUNJGAMES_BROADCAST_WINDOW', '0'))  # seconds to merge broadcasts
+# binary formats encoded once per broadcast, others are encoded per connection that asks for them
+GAMES_WIRE_FORMATS = [name for name in os.environ.get('BUNJGAMES_WIRE_FORMATS', '').split(',') if name]
+GAMES_TIMER_TICK = 0.05
+GAMES_BUTTON_SETTLE = 0.05  # seconds a button window stays open for compensated presses
+GAMES_TIMER_SLOTS = 1024
+GAMES_IMPORT_WORKERS = int(os.environ.get('BUNJGAMES_IMPORT_WORKERS', '2'))
+GAMES_IMPORT_KEEP_TIME = 60 * 60
+GAMES_PACK_CACHE_SIZE = int(os.environ.get('BUNJGAMES_PACK_CACHE_SIZE', str(10 * 1024 ** 3)))
+GAMES_REAPER_INTERVAL = int(os.environ.get('BUNJGAMES_REAPER_INTERVAL', '0'))  # seconds, 0 leaves it to cron
+GAMES_REAPER_BATCH_SIZE = 50
+GAMES_MEDIA_OPTIMIZE = os.environ.get('BUNJGAMES_MEDIA_OPTIMIZE', 'False').lower() != 'false'
+GAMES_MEDIA_WORKERS = int(os.environ.get('BUNJGAMES_MEDIA_WORKERS', '2'))
+GAMES_MEDIA_MAX_IMAGE_SIZE = 1920
+GAMES_MEDIA_MAX_IMAGE_BYTES = 1024 * 1024
+GAMES_MEDIA_MAX_AUDIO_RATE = 22050
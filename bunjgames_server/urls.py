@@ -1,5 +1,3 @@
-from django.conf import settings
-from django.conf.urls.static import static
 from django.urls import path, include
 
 urlpatterns = [
@@ -8,4 +6,4 @@ urlpatterns = [
     path('jeopardy/', include('jeopardy.urls')),
     path('weakest/', include('weakest.urls')),
     path('feud/', include('feud.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
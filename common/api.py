@@ -4,7 +4,10 @@ from django.utils.functional import cached_property
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from common.imports import import_queue
+from common.metrics import metrics
 from common.serializers import TokenSerializer
+from common.utils import BadStateException
 
 
 class TokenContextMixin:
@@ -26,3 +29,16 @@ class TimeAPI(APIView):
         return Response(dict(
             time=int(round(time.time() * 1000))
         ))
+
+
+class ImportStatusAPI(APIView):
+    def get(self, request, job_id):
+        status = import_queue.get_status(job_id)
+        if status is None:
+            raise BadStateException('Import not found')
+        return Response(status)
+
+
+class MetricsAPI(APIView):
+    def get(self, request):
+        return Response(metrics.get())
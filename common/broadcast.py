@@ -0,0 +1,176 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from common.patch import diff
+from common.wire import WIRE_FORMATS
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotStore:
+    # last snapshot seen by this process per room, versions come from the game row.
+    # a patch is only made from an older version, clients apply it only on top of that exact version
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.snapshots = OrderedDict()
+
+    def update(self, room_name, version, message):
+        with self.lock:
+            previous_version, previous = self.snapshots.pop(room_name, (None, None))
+            if previous_version is not None and previous_version > version:
+                self.snapshots[room_name] = (previous_version, previous)
+            else:
+                self.snapshots[room_name] = (version, message)
+            while len(self.snapshots) > self.size:
+                self.snapshots.popitem(last=False)
+        if previous is None or previous_version >= version:
+            return None, None
+        return previous_version, diff(previous, message)
+
+
+snapshots = SnapshotStore(settings.GAMES_SNAPSHOTS_CACHE_SIZE)
+
+
+def make_payload(type, message, **kwargs):
+    return {
+        'type': type,
+        'message': message,
+        **kwargs
+    }
+
+
+def encode_message(type, message, **kwargs):
+    return json.dumps(make_payload(type, message, **kwargs))
+
+
+def encode_binary(payload):
+    # binary frames are encoded once per broadcast, not once per connection
+    return {
+        name: WIRE_FORMATS[name].encode(payload) for name in settings.GAMES_WIRE_FORMATS if name in WIRE_FORMATS
+    }
+
+
+def make_event(type, message):
+    payload = make_payload(type, message)
+    return {
+        'type': type,
+        'frame': json.dumps(payload),
+        'frames': encode_binary(payload),
+    }
+
+
+def make_game_event(room_name, message, version):
+    base, patch = snapshots.update(room_name, version, message)
+    payload = make_payload('game', message, version=version)
+    event = {
+        'type': 'game',
+        'version': version,
+        'frame': json.dumps(payload),
+        'frames': encode_binary(payload),
+    }
+    if patch is not None:
+        patch_payload = make_payload('game_patch', {
+            'version': version,
+            'base': base,
+            'patch': patch
+        })
+        patch_frame = json.dumps(patch_payload)
+        if len(patch_frame) < len(event['frame']):
+            event.update(base=base, patch_frame=patch_frame, patch_frames=encode_binary(patch_payload))
+    return event
+
+
+def make_batch_event(events):
+    # one event for the channel layer, a game snapshot followed by a newer one is dropped
+    merged = []
+    for event in events:
+        if event['type'] == 'game' and merged and merged[-1]['type'] == 'game':
+            merged.pop()
+        merged.append(event)
+    return merged[0] if len(merged) == 1 else {'type': 'batch', 'events': merged}
+
+
+def make_room_event(room_name, type, message, version=None):
+    return make_game_event(room_name, message, version) if type == 'game' else make_event(type, message)
+
+
+async def group_send(room_name, type, message, version=None):
+    await get_channel_layer().group_send(room_name, make_room_event(room_name, type, message, version))
+
+
+class TransitionEvents(threading.local):
+    # events produced while a transition of a room runs in this thread
+    def __init__(self):
+        self.batches = {}
+
+    @contextmanager
+    def collect(self, room_name):
+        batch = self.batches[room_name] = []
+        try:
+            yield batch
+        finally:
+            del self.batches[room_name]
+
+    def add(self, room_name, event):
+        batch = self.batches.get(room_name)
+        if batch is None:
+            return False
+        batch.append(event)
+        return True
+
+
+transition_events = TransitionEvents()
+
+
+class BroadcastScheduler:
+    # sends the events of a room as one batch, merging what arrives within `window` seconds.
+    # the flush is a loop callback, a sender that is cancelled or busy does not hold the batch back
+    def __init__(self, window):
+        self.window = window
+        self.pending = {}
+        self.tasks = set()
+
+    async def send(self, room_name, events):
+        if not events:
+            return
+        if not self.window:
+            return await get_channel_layer().group_send(room_name, make_batch_event(events))
+        pending = self.pending.get(room_name)
+        if pending is not None:
+            pending.extend(events)
+            return
+        self.pending[room_name] = list(events)
+        asyncio.get_running_loop().call_later(self.window, self.flush, room_name)
+
+    def flush(self, room_name):
+        events = self.pending.pop(room_name, None)
+        if events:
+            task = asyncio.ensure_future(self.group_send(room_name, events))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    @staticmethod
+    async def group_send(room_name, events):
+        try:
+            await get_channel_layer().group_send(room_name, make_batch_event(events))
+        except Exception as e:
+            logger.error('Broadcast to %s failed: %s' % (room_name, str(e)))
+
+
+broadcast_scheduler = BroadcastScheduler(settings.GAMES_BROADCAST_WINDOW)
+
+
+def group_send_sync(room_name, type, message, version=None):
+    event = make_room_event(room_name, type, message, version)
+    if not transition_events.add(room_name, event):
+        transaction.on_commit(lambda: async_to_sync(get_channel_layer().group_send)(room_name, event))
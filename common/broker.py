@@ -0,0 +1,227 @@
+import asyncio
+import itertools
+import logging
+import struct
+import time
+from collections import deque, defaultdict
+
+import msgpack
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>I')
+
+
+def pack_frame(payload):
+    return HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader):
+    size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return msgpack.unpackb(await reader.readexactly(size), raw=False)
+
+
+async def open_address(address):
+    if address.startswith('unix:'):
+        return await asyncio.open_unix_connection(address[len('unix:'):])
+    host, port = address.rsplit(':', 1)
+    return await asyncio.open_connection(host, int(port))
+
+
+async def start_address(handler, address):
+    if address.startswith('unix:'):
+        return await asyncio.start_unix_server(handler, address[len('unix:'):])
+    host, port = address.rsplit(':', 1)
+    return await asyncio.start_server(handler, host, int(port))
+
+
+class BrokerClient:
+    def __init__(self, writer):
+        self.writer = writer
+        self.closed = False
+
+    def reply(self, request_id, result):
+        if not self.closed:
+            self.writer.write(pack_frame(msgpack.packb([request_id, result], use_bin_type=True)))
+
+
+class Broker:
+    # messages stay packed, a group send writes the same bytes to every member
+    def __init__(self, capacity=100, expiry=60, group_expiry=86400):
+        self.capacity = capacity
+        self.expiry = expiry
+        self.group_expiry = group_expiry
+        self.queues = {}
+        self.waiters = defaultdict(deque)
+        self.groups = defaultdict(dict)
+
+    def deliver(self, channel, message):
+        waiters = self.waiters.get(channel)
+        while waiters:
+            client, request_id = waiters.popleft()
+            if not client.closed:
+                client.reply(request_id, message)
+                return True
+        queue = self.queues.setdefault(channel, deque())
+        if len(queue) >= self.capacity:
+            return False
+        queue.append((time.time() + self.expiry, message))
+        return True
+
+    def op_send(self, client, request_id, channel, message):
+        return self.deliver(channel, message)
+
+    def op_receive(self, client, request_id, channel):
+        queue = self.queues.get(channel)
+        if queue:
+            _, message = queue.popleft()
+            if not queue:
+                del self.queues[channel]
+            return message
+        self.waiters[channel].append((client, request_id))
+
+    def op_cancel(self, client, request_id, cancelled_id):
+        for channel, waiters in list(self.waiters.items()):
+            if (client, cancelled_id) in waiters:
+                waiters.remove((client, cancelled_id))
+            if not waiters:
+                del self.waiters[channel]
+
+    def op_group_add(self, client, request_id, group, channel):
+        self.groups[group][channel] = time.time()
+        return True
+
+    def op_group_discard(self, client, request_id, group, channel):
+        self.groups.get(group, {}).pop(channel, None)
+        if not self.groups.get(group):
+            self.groups.pop(group, None)
+        return True
+
+    def op_group_send(self, client, request_id, group, message):
+        for channel in list(self.groups.get(group, ())):
+            self.deliver(channel, message)
+        return True
+
+    def op_flush(self, client, request_id):
+        self.queues.clear()
+        self.groups.clear()
+        return True
+
+    def remove_from_groups(self, channel):
+        for group, channels in list(self.groups.items()):
+            channels.pop(channel, None)
+            if not channels:
+                del self.groups[group]
+
+    def clean_expired(self):
+        now = time.time()
+        for channel, queue in list(self.queues.items()):
+            while queue and queue[0][0] < now:
+                queue.popleft()
+                self.remove_from_groups(channel)
+            if not queue:
+                del self.queues[channel]
+
+        timeout = now - self.group_expiry
+        for group, channels in list(self.groups.items()):
+            for channel, joined in list(channels.items()):
+                if joined < timeout:
+                    del channels[channel]
+            if not channels:
+                del self.groups[group]
+
+    def drop(self, client):
+        client.closed = True
+        for channel, waiters in list(self.waiters.items()):
+            self.waiters[channel] = deque(waiter for waiter in waiters if waiter[0] is not client)
+            if not self.waiters[channel]:
+                del self.waiters[channel]
+
+    async def handle(self, reader, writer):
+        client = BrokerClient(writer)
+        try:
+            while True:
+                request_id, op, *args = await read_frame(reader)
+                result = getattr(self, 'op_' + op)(client, request_id, *args)
+                if request_id and result is not None:
+                    client.reply(request_id, result)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except (AttributeError, TypeError, ValueError) as e:
+            logger.warning('Bad broker request: %s' % str(e))
+        finally:
+            self.drop(client)
+            writer.close()
+
+    async def clean(self):
+        while True:
+            await asyncio.sleep(1)
+            self.clean_expired()
+
+    async def serve(self, address, started=None):
+        server = await start_address(self.handle, address)
+        cleaner = asyncio.ensure_future(self.clean())
+        if started is not None:
+            started.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            cleaner.cancel()
+
+
+class BrokerConnection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count(1)
+        self.futures = {}
+        self.drain_lock = asyncio.Lock()
+        self.closed = False
+        self.reader_task = asyncio.ensure_future(self.read())
+
+    @classmethod
+    async def open(cls, address):
+        return cls(*await open_address(address))
+
+    def request(self, op, *args, reply=True):
+        if self.closed:
+            raise ConnectionError('Broker connection is closed')
+        request_id = next(self.ids) if reply else 0
+        self.writer.write(pack_frame(msgpack.packb([request_id, op, *args], use_bin_type=True)))
+        if not reply:
+            return request_id, None
+        future = asyncio.get_running_loop().create_future()
+        self.futures[request_id] = future
+        return request_id, future
+
+    async def drain(self):
+        if self.writer.transport.get_write_buffer_size() > 0:
+            async with self.drain_lock:
+                await self.writer.drain()
+
+    async def call(self, op, *args):
+        _, future = self.request(op, *args)
+        await self.drain()
+        return await future
+
+    async def read(self):
+        try:
+            while True:
+                request_id, result = await read_frame(self.reader)
+                future = self.futures.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(result)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            error = ConnectionError('Broker connection lost: %s' % str(e))
+        finally:
+            self.closed = True
+        for future in self.futures.values():
+            if not future.done():
+                future.set_exception(error)
+        self.futures.clear()
+
+    def close(self):
+        self.closed = True
+        self.reader_task.cancel()
+        self.writer.close()
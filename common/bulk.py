@@ -0,0 +1,39 @@
+from django.db import connections, router
+
+
+class BulkLoader:
+    # collects unsaved rows and inserts them model by model, parents before children
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size
+        self.rows = {}
+
+    def add(self, instance):
+        self.rows.setdefault(type(instance), []).append(instance)
+        return instance
+
+    @staticmethod
+    def resolve_foreign_keys(model, rows):
+        fields = [field for field in model._meta.concrete_fields if field.many_to_one]
+        for row in rows:
+            for field in fields:
+                if field.is_cached(row):
+                    related = field.get_cached_value(row)
+                    if related is not None:
+                        setattr(row, field.attname, related.pk)
+
+    def save(self):
+        models = list(self.rows)
+        for i, model in enumerate(models):
+            rows = self.rows[model]
+            self.resolve_foreign_keys(model, rows)
+            connection = connections[router.db_for_write(model)]
+            is_referenced = any(
+                field.many_to_one and field.related_model is model
+                for child in models[i + 1:] for field in child._meta.concrete_fields
+            )
+            if is_referenced and not connection.features.can_return_rows_from_bulk_insert:
+                for row in rows:
+                    row.save(force_insert=True)
+            else:
+                model.objects.bulk_create(rows, batch_size=self.batch_size)
+        self.rows = {}
@@ -0,0 +1,77 @@
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+from common.metrics import metrics
+
+Press = namedtuple('Press', ['pressed_at', 'received_at', 'key'])
+
+
+class ButtonArbiter:
+    # per room button windows, presses are claimed on arrival before any database work.
+    # a window is a list of presses in arrival order; presses arriving within `settle` of the first
+    # one compete by their (clock compensated) press time, ties go to the earlier arrival.
+    # list.append and dict lookups are atomic, no lock is taken on the press path
+    CLOSED = ()
+
+    def __init__(self, settle):
+        self.settle = int(settle * 1e9)
+        self.windows = {}
+
+    def open(self, room_name):
+        self.windows[room_name] = []
+
+    def close(self, room_name):
+        self.windows[room_name] = self.CLOSED
+
+    def reset(self, room_name, is_open):
+        if is_open:
+            self.open(room_name)
+        else:
+            self.close(room_name)
+
+    def setdefault(self, room_name, is_open):
+        if room_name not in self.windows:
+            self.reset(room_name, is_open)
+
+    def discard(self, room_name):
+        self.windows.pop(room_name, None)
+
+    def press(self, room_name, key, received_at=None, pressed_at=None):
+        # the press to decide on later, False for a late or closed press, None when the room state is unknown
+        window = self.windows.get(room_name)
+        if window is None:
+            return None
+        if window is self.CLOSED:
+            return False
+        received_at = received_at or time.monotonic_ns()
+        if window and received_at > window[0].received_at + self.settle:
+            metrics.increment('button_presses_lost')
+            return False
+        # a press can not happen after it was received or earlier than the settle time allows
+        pressed_at = min(max(pressed_at or received_at, received_at - self.settle), received_at)
+        press = Press(pressed_at, received_at, key)
+        window.append(press)
+        return press
+
+    def get_delay(self, room_name):
+        # seconds until the window of the room is decided
+        window = self.windows.get(room_name)
+        if not window:
+            return 0
+        return max(window[0].received_at + self.settle - time.monotonic_ns(), 0) / 1e9
+
+    def decide(self, room_name, press):
+        window = self.windows.get(room_name)
+        if not window or min(window, key=lambda item: item.pressed_at) is not press:
+            metrics.increment('button_presses_lost')
+            return False
+        metrics.increment('button_presses_won')
+        return True
+
+    def get_presses(self, room_name):
+        return list(self.windows.get(room_name) or ())
+
+
+button_arbiter = ButtonArbiter(settings.GAMES_BUTTON_SETTLE)
@@ -1,18 +1,48 @@
+import asyncio
 import json
 import logging
+import time
+import weakref
+from asyncio import Lock
+from collections import deque
+from urllib.parse import parse_qs
 
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 
-from common.utils import BadStateException, BadFormatException, NothingToDoException
+from common.buttons import button_arbiter
+from common.broadcast import broadcast_scheduler, make_event, make_game_event, make_payload, transition_events
+from common.engine import game_engine
+from common.media import media_manifests
+from common.metrics import metrics
+from common.timers import timer_wheel
+from common.wire import JSON, WIRE_FORMATS, get_wire_format
+from common.utils import BadStateException, BadFormatException, NothingToDoException, game_sync_to_async
 
 logger = logging.getLogger(__name__)
 
 
-class Consumer(WebsocketConsumer):
+class Consumer(AsyncWebsocketConsumer):
     token = None
     room_name = None
+    room_lock = None
+    patches = False
+    batches = False
+    acks = False
+    wire_format = JSON
+    version = None
+    button_route = None
+    clock_offset = None
+    clock_rtt = None
+    outbox = None
+    outbox_ready = None
+    sender = None
+    unacked = None
+    acked = None
+
+    room_locks = weakref.WeakValueDictionary()
 
     @property
     def routes(self):
@@ -28,60 +58,304 @@ class Consumer(WebsocketConsumer):
     def serialize_game(self, game):
         raise NotImplemented()
 
-    def connect(self):
+    def is_button_open(self, game):
+        return False
+
+    @property
+    def arbitrates_buttons(self):
+        # windows are only trusted when this process owns the room state
+        return self.button_route is not None and game_engine.enabled
+
+    def get_timer(self, game):
+        # (deadline in epoch ms, paused) of the running game timer
+        return None
+
+    def timer_expired(self, game):
+        raise NothingToDoException()
+
+    def update_timer(self, game):
+        timer = self.get_timer(game)
+        delay = timer[0] / 1000 - time.time() if timer else 0
+        if timer is None or timer[1] or delay <= 0:
+            # a paused timer is scheduled again from its shifted deadline when it resumes
+            timer_wheel.cancel(self.room_name)
+        else:
+            timer_wheel.schedule(self.room_name, delay, self.expire_timer)
+
+    def get_media_manifest_key(self, game):
+        return None
+
+    def get_media_manifest(self, game):
+        return []
+
+    def make_manifest_events(self, game, only_new=False):
+        key = self.get_media_manifest_key(game)
+        if key is None:
+            return []
+        media, is_new = media_manifests.get(self.room_name, key, lambda: self.get_media_manifest(game))
+        if only_new and not is_new:
+            return []
+        return [make_event('media_manifest', {'key': key, 'media': media})]
+
+    def load(self):
+        with game_engine.use(self.room_name, lambda: self.get_game(self.token)) as game:
+            if self.arbitrates_buttons:
+                button_arbiter.setdefault(self.room_name, self.is_button_open(game))
+            self.update_timer(game)
+            return [
+                make_game_event(self.room_name, self.serialize_game(game), game.version)
+            ] + self.make_manifest_events(game)
+
+    def process(self, method, params):
+        return self.apply(lambda game: self.routes[method](game, **params), method)
+
+    def expire(self):
+        def action(game):
+            timer = self.get_timer(game)
+            if timer is None or timer[1] or timer[0] > (time.time() + timer_wheel.tick) * 1000:
+                raise NothingToDoException()
+            self.timer_expired(game)
+        return self.apply(action)
+
+    def apply(self, action, method=None):
+        # everything a transition broadcasts is returned as one batch, sent once it has committed
+        with game_engine.use(self.room_name, lambda: self.get_game(self.token)) as game, \
+                transaction.atomic(), transition_events.collect(self.room_name) as events:
+            action(game)
+            if self.arbitrates_buttons and method != self.button_route:
+                button_arbiter.reset(self.room_name, self.is_button_open(game))
+            self.update_timer(game)
+            version = game.bump_version()
+            events.append(make_game_event(self.room_name, self.serialize_game(game), version))
+            events.extend(self.make_manifest_events(game, only_new=True))
+        return events
+
+    async def connect(self):
         self.token = self.scope['url_route']['kwargs']['token'].upper().strip()
         self.room_name = f'{self.game_name}_{self.token}'
+        self.room_lock = self.room_locks.setdefault(self.room_name, Lock())
+        query = parse_qs(self.scope['query_string'].decode())
+        self.patches = query.get('patch') == ['1']
+        self.batches = query.get('batch') == ['1']
+        # clients with ?ack=1 acknowledge the game versions they applied, snapshots wait while too many are not
+        self.acks = query.get('ack') == ['1']
+        # bunjgames.msgpack / bunjgames.cbor subprotocols or ?format=, json stays the default
+        subprotocol = next((
+            protocol for protocol in self.scope.get('subprotocols', [])
+            if protocol.startswith('bunjgames.') and protocol[len('bunjgames.'):] in WIRE_FORMATS
+        ), None)
+        self.wire_format = get_wire_format(
+            subprotocol[len('bunjgames.'):] if subprotocol else query.get('format', [''])[0]
+        )
+        timer_wheel.bind(asyncio.get_running_loop())
 
         try:
-            game = self.get_game(self.token)
-            async_to_sync(self.channel_layer.group_add)(
+            events = await game_sync_to_async(self.load)()
+            await self.channel_layer.group_add(
                 self.room_name,
                 self.channel_name
             )
-            self.accept()
-            self.send(text_data=json.dumps({
-                'type': 'game',
-                'message': self.serialize_game(game)
-            }))
+            await self.accept(subprotocol)
+            self.outbox, self.outbox_ready = deque(), asyncio.Event()
+            self.unacked, self.acked = deque(), asyncio.Event()
+            self.sender = asyncio.ensure_future(self.run_sender())
+            await self.send_events(events)
         except ObjectDoesNotExist:
             logger.debug('Bad token')
-            self.close()
+            await self.close()
 
-    def disconnect(self, close_code):
-        async_to_sync(self.channel_layer.group_discard)(
+    async def disconnect(self, close_code):
+        if self.sender is not None:
+            self.sender.cancel()
+        await self.channel_layer.group_discard(
             self.room_name,
             self.channel_name
         )
 
-    def receive(self, text_data=None, bytes_data=None):
-        data = json.loads(text_data)
-
-        game = self.get_game(self.token)
+    async def receive(self, text_data=None, bytes_data=None):
+        received_at, received_time = time.monotonic_ns(), time.time()
+        data = self.wire_format.decode(bytes_data) if bytes_data is not None else json.loads(text_data)
 
         try:
-            if data['method'] == 'intercom':
-                async_to_sync(self.channel_layer.group_send)(self.room_name, {
-                    'type': 'intercom',
-                    'message': data['message']
+            if data['method'] == 'ping':
+                await self.send_message('pong', {
+                    't0': data['params']['t0'],
+                    't1': round(received_time * 1000, 3),
+                    't2': round(time.time() * 1000, 3),
                 })
+            elif data['method'] == 'clock_report':
+                self.set_clock(data['params']['samples'])
+                await self.send_message('clock', {'offset': self.clock_offset, 'rtt': self.clock_rtt})
+            elif data['method'] == 'intercom':
+                await broadcast_scheduler.send(self.room_name, [make_event('intercom', data['message'])])
+            elif data['method'] == 'ack':
+                self.ack(data['params']['version'])
+            elif data['method'] == 'snapshot':
+                await self.send_events(await game_sync_to_async(self.load)())
             else:
-                self.routes[data['method']](game, **data['params'])
+                if data['method'] == self.button_route:
+                    pressed_at = self.get_pressed_at(data['params'].pop('pressed_at', None), received_at, received_time)
+                if data['method'] == self.button_route and self.arbitrates_buttons:
+                    events = await self.process_button(data['params'], received_at, pressed_at)
+                else:
+                    async with self.room_lock:
+                        events = await game_sync_to_async(self.process)(data['method'], data['params'])
 
-                async_to_sync(self.channel_layer.group_send)(self.room_name, {
-                    'type': 'game',
-                    'message': self.serialize_game(game)
-                })
+                await broadcast_scheduler.send(self.room_name, events)
         except NothingToDoException:
             pass
         except (BadStateException, BadFormatException, KeyError, TypeError, ValueError) as e:
-            self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': str(e)
-            }))
+            self.push(make_event('error', str(e)))
             logger.warning('Bad request: %s' % str(e))
 
-    def intercom(self, event):
-        self.send(text_data=json.dumps(event))
+    def set_clock(self, samples):
+        # NTP estimate from [t0, t1, t2, t3] samples in ms, t1 and t2 are ours from the pongs.
+        # the sample with the shortest round trip has the least asymmetric delay
+        estimates = [
+            (((t1 - t0) + (t2 - t3)) / 2, (t3 - t0) - (t2 - t1)) for t0, t1, t2, t3 in samples[:64]
+        ]
+        estimates = [estimate for estimate in estimates if estimate[1] >= 0]
+        if not estimates:
+            raise BadFormatException('Bad clock samples')
+        self.clock_offset, self.clock_rtt = min(estimates, key=lambda estimate: estimate[1])
+
+    def get_pressed_at(self, pressed_at, received_at, received_time):
+        # client press time in ms to our monotonic clock, only for clients that reported their clock
+        if pressed_at is None or self.clock_offset is None:
+            return None
+        return received_at - int((received_time * 1000 - (float(pressed_at) + self.clock_offset)) * 1e6)
+
+    async def process_button(self, params, received_at, pressed_at=None):
+        # presses are decided in the room window, only the winner waits for the room
+        press = button_arbiter.press(self.room_name, self.channel_name, received_at, pressed_at)
+        if press is False:
+            raise NothingToDoException()
+        if press is not None:
+            await asyncio.sleep(button_arbiter.get_delay(self.room_name))
+            if not button_arbiter.decide(self.room_name, press):
+                raise NothingToDoException()
+        try:
+            async with self.room_lock:
+                return await game_sync_to_async(self.process)(self.button_route, params)
+        except Exception:
+            # let the database decide until the next transition
+            button_arbiter.discard(self.room_name)
+            raise
+
+    async def expire_timer(self):
+        # runs on the wheel, also for rooms whose connection is gone
+        try:
+            async with self.room_lock:
+                events = await game_sync_to_async(self.expire)()
+        except (NothingToDoException, ObjectDoesNotExist):
+            return
+        await broadcast_scheduler.send(self.room_name, events)
+
+    async def intercom(self, event):
+        self.push(event)
+
+    async def import_progress(self, event):
+        self.push(event)
+
+    async def media_manifest(self, event):
+        self.push(event)
+
+    async def game(self, event):
+        self.push(event)
+
+    async def batch(self, event):
+        self.push(event)
+
+    async def send_events(self, events):
+        for event in events:
+            self.push(event, force=event['type'] == 'game')
+
+    def push(self, event, force=False):
+        # bounded outbox, a game snapshot waiting behind another one replaces it, other events keep their order
+        if self.outbox is None:
+            return
+        if event['type'] == 'game' and self.outbox and self.outbox[-1][0]['type'] == 'game':
+            previous, previous_force = self.outbox.pop()
+            if previous['version'] > event['version']:
+                event = previous
+            force = force or previous_force
+            metrics.increment('outbox_coalesced')
+        elif len(self.outbox) >= settings.GAMES_OUTBOX_LIMIT:
+            logger.warning('Client of %s is too slow, disconnecting' % self.room_name)
+            metrics.increment('outbox_disconnects')
+            self.outbox = None
+            self.sender.cancel()
+            asyncio.ensure_future(self.close(code=4008))
+            return
+        self.outbox.append((event, force))
+        self.outbox_ready.set()
+
+    def ack(self, version):
+        while self.unacked and self.unacked[0] <= version:
+            self.unacked.popleft()
+        self.acked.set()
+
+    @staticmethod
+    def has_game(event):
+        return any(item['type'] == 'game' for item in event.get('events', [event]))
+
+    async def wait_for_acks(self):
+        # a held back snapshot stays last in the outbox, newer ones replace it until the client catches up
+        while len(self.unacked) >= settings.GAMES_ACK_WINDOW:
+            self.acked.clear()
+            await self.acked.wait()
+
+    async def run_sender(self):
+        try:
+            while True:
+                await self.outbox_ready.wait()
+                while self.outbox:
+                    if self.acks and self.has_game(self.outbox[0][0]):
+                        await self.wait_for_acks()
+                    event, force = self.outbox.popleft()
+                    frames = [self.get_frame(item, force) for item in event.get('events', [event])]
+                    frames = [frame for frame in frames if frame is not None]
+                    if len(frames) > 1 and self.batches:
+                        # frames are already encoded, the batch is joined around them
+                        await self.send_frame(self.wire_format.join(frames))
+                    else:
+                        for frame in frames:
+                            await self.send_frame(frame)
+                self.outbox_ready.clear()
+        except Exception as e:
+            logger.warning('Sending to a client of %s failed: %s' % (self.room_name, str(e)))
+            metrics.increment('outbox_failures')
+            self.outbox = None
+            await self.close(code=1011)
+
+    def get_frame(self, event, force=False):
+        if event['type'] != 'game':
+            return self.select_frame(event, 'frame')
+        if not force and self.version is not None and event['version'] < self.version:
+            # versions come from the game row, an older one was overtaken by a snapshot from another worker
+            return None
+        key = 'frame'
+        if self.patches and not force and 'patch_frame' in event and event['base'] == self.version:
+            key = 'patch_frame'
+        self.version = event['version']
+        if self.acks:
+            self.unacked.append(self.version)
+        return self.select_frame(event, key)
+
+    def select_frame(self, event, key):
+        if self.wire_format is JSON:
+            return event[key]
+        frame = event.get(key + 's', {}).get(self.wire_format.name)
+        if frame is None:
+            # not pre-encoded in this format
+            frame = self.wire_format.encode(json.loads(event[key]))
+        return frame
+
+    async def send_message(self, type, message):
+        await self.send_frame(self.wire_format.encode(make_payload(type, message)))
 
-    def game(self, event):
-        self.send(text_data=json.dumps(event))
+    async def send_frame(self, frame):
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
@@ -0,0 +1,233 @@
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import F
+
+from common.utils import BadStateException
+
+logger = logging.getLogger(__name__)
+
+
+class EngineGameMixin:
+    engine_room = None
+
+    def save(self, *args, **kwargs):
+        if self.engine_room is not None and not kwargs.get('force_insert'):
+            game_engine.mark_dirty(self.engine_room, kwargs.get('update_fields'))
+            return
+        super().save(*args, **kwargs)
+
+    def bump_version(self):
+        # snapshot version, bumped in the transaction that changed the game so every worker agrees on it
+        if self.engine_room is not None:
+            return game_engine.write(self.engine_room)
+        queryset = type(self).objects.filter(pk=self.pk)
+        queryset.update(version=F('version') + 1)
+        self.version = queryset.values_list('version', flat=True).get()
+        return self.version
+
+    def lock_for_update(self):
+        if self.engine_room is not None:
+            return self
+        return type(self).objects.select_for_update().get(pk=self.pk)
+
+
+class GameEngine:
+    # cache of the game rows of the rooms this process serves. The saves of a transition are batched into
+    # one update, written with the version bump in the transaction of the transition, so the row never
+    # lags its children. A cached row is used only while its version is the one in the database, the room
+    # may have been served by another process meanwhile. Rows are only ever updated, never inserted again
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.games = {}
+        self.used = {}
+        self.room_locks = {}
+        self.dirty = {}
+        self.flusher = None
+
+    @property
+    def enabled(self):
+        return settings.GAMES_ENGINE_ENABLED
+
+    def room_lock(self, room_name):
+        with self.lock:
+            return self.room_locks.setdefault(room_name, threading.RLock())
+
+    @contextmanager
+    def lock_room(self, room_name):
+        if not self.enabled:
+            yield
+            return
+        with self.room_lock(room_name):
+            yield
+
+    def get(self, room_name, loader):
+        if not self.enabled:
+            return loader()
+        with self.room_lock(room_name):
+            with self.lock:
+                game = self.games.get(room_name)
+            if game is not None and not type(game).objects.filter(pk=game.pk, version=game.version).exists():
+                self.discard(room_name)
+                game = None
+            if game is None:
+                game = loader()
+                game.engine_room = room_name
+                with self.lock:
+                    self.games[room_name] = game
+                self.start()
+            with self.lock:
+                self.used[room_name] = time.monotonic()
+            return game
+
+    @contextmanager
+    def use(self, room_name, loader):
+        if not self.enabled:
+            yield loader()
+            return
+        with self.room_lock(room_name):
+            game = self.get(room_name, loader)
+            values = self.get_values(game)
+            with self.lock:
+                pending = self.dirty.get(room_name, False)
+            game._state.fields_cache.clear()
+            game.__dict__.pop('_prefetched_objects_cache', None)
+            try:
+                yield game
+            except BaseException:
+                self.set_values(game, values)
+                game._state.fields_cache.clear()
+                if pending is not False:
+                    # a rolled back write takes the saves from before the transition with it
+                    self.mark_dirty(room_name, pending)
+                raise
+
+    @staticmethod
+    def get_values(game):
+        return {field.attname: getattr(game, field.attname) for field in game._meta.concrete_fields}
+
+    @staticmethod
+    def set_values(game, values):
+        for name, value in values.items():
+            setattr(game, name, value)
+
+    def mark_dirty(self, room_name, fields):
+        with self.lock:
+            if fields is None:
+                self.dirty[room_name] = None
+            elif room_name not in self.dirty:
+                self.dirty[room_name] = set(fields)
+            elif self.dirty[room_name] is not None:
+                self.dirty[room_name].update(fields)
+
+    @staticmethod
+    def get_fields(model, fields):
+        if fields is not None:
+            return fields
+        return [field.name for field in model._meta.concrete_fields if not field.primary_key]
+
+    def write(self, room_name):
+        # runs in the transaction of the transition, the update only applies over the version it was loaded with
+        with self.room_lock(room_name):
+            with self.lock:
+                game = self.games[room_name]
+                names = self.dirty.pop(room_name, [])
+            model = type(game)
+            fields = [model._meta.get_field(name) for name in self.get_fields(model, names) if name != 'version']
+            values = {field.attname: getattr(game, field.attname) for field in fields}
+            if not model.objects.filter(pk=game.pk, version=game.version).update(version=game.version + 1, **values):
+                self.discard(room_name)
+                raise BadStateException('Game was changed, try again')
+            game.version += 1
+            return game.version
+
+    def write_batch(self, model, games, fields):
+        # bulk_update never inserts, rooms whose row is gone (reaped by another process) are dropped
+        updated = model.objects.bulk_update(games, sorted(fields), batch_size=settings.GAMES_ENGINE_BATCH_SIZE)
+        if updated < len(games):
+            existing = set(model.objects.filter(pk__in=[game.pk for game in games]).values_list('pk', flat=True))
+            for game in games:
+                if game.pk not in existing:
+                    self.discard(game.engine_room)
+
+    def flush(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+        batches = defaultdict(lambda: ([], set()))
+        for room_name, fields in dirty.items():
+            with self.room_lock(room_name):
+                game = self.games.get(room_name)
+                if game is None:
+                    continue
+                model = type(game)
+                copies, names = batches[model]
+                copy = model(**self.get_values(game))
+                copy.engine_room = room_name
+                copies.append(copy)
+                names.update(self.get_fields(model, fields))
+        try:
+            with transaction.atomic():
+                for model, (copies, names) in batches.items():
+                    self.write_batch(model, copies, names)
+        except Exception as e:
+            logger.error('Engine flush failed: %s' % str(e))
+            for room_name, fields in dirty.items():
+                self.mark_dirty(room_name, fields)
+
+    def discard(self, room_name):
+        # the game row was deleted, pending changes are dropped with it
+        with self.lock:
+            self.games.pop(room_name, None)
+            self.dirty.pop(room_name, None)
+            self.used.pop(room_name, None)
+
+    def evict(self, idle_time):
+        now = time.monotonic()
+        with self.lock:
+            rooms = [room_name for room_name, used in self.used.items() if now - used > idle_time]
+        for room_name in rooms:
+            lock = self.room_lock(room_name)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                with self.lock:
+                    if now - self.used.get(room_name, now) <= idle_time:
+                        continue
+                    game = self.games.pop(room_name, None)
+                    fields = self.dirty.pop(room_name, False)
+                    self.used.pop(room_name, None)
+                if game is None:
+                    continue
+                if fields is not False:
+                    self.write_batch(type(game), [game], self.get_fields(type(game), fields))
+                game.engine_room = None
+            finally:
+                lock.release()
+
+    def start(self):
+        with self.lock:
+            if self.flusher is not None:
+                return
+            self.flusher = threading.Thread(target=self.run, name='games-engine', daemon=True)
+        atexit.register(self.flush)
+        self.flusher.start()
+
+    def run(self):
+        while True:
+            time.sleep(settings.GAMES_ENGINE_FLUSH_INTERVAL)
+            try:
+                self.flush()
+                self.evict(settings.GAMES_ENGINE_IDLE_TIME)
+            except Exception as e:
+                logger.error('Engine failed: %s' % str(e))
+            finally:
+                close_old_connections()
+
+
+game_engine = GameEngine()
@@ -0,0 +1,253 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from common.broadcast import group_send_sync
+from common.media import media_manifests
+from common.models import ImportStatus
+from common.packs import pack_cache
+from common.transcode import transcoder
+from common.utils import CHUNK_SIZE, BadFormatException, BadStateException, get_file_digest, unzip
+
+logger = logging.getLogger(__name__)
+
+
+class ImportJob:
+    STATE_QUEUED = 'queued'
+    STATE_EXTRACTING = 'extracting'
+    STATE_PARSING = 'parsing'
+    STATE_DONE = 'done'
+    STATE_FAILED = 'failed'
+
+    REPORT_INTERVAL = 0.25
+
+    def __init__(self, room_name, token):
+        self.id = uuid.uuid4().hex
+        self.room_name = room_name
+        self.token = token
+        self.state = self.STATE_QUEUED
+        self.bytes_total = 0
+        self.bytes_extracted = 0
+        self.questions_parsed = 0
+        self.error = None
+        self.finished = None
+        self.reported = 0
+
+    def to_representation(self):
+        return {
+            'job': self.id,
+            'token': self.token,
+            'state': self.state,
+            'bytes_total': self.bytes_total,
+            'bytes_extracted': self.bytes_extracted,
+            'questions_parsed': self.questions_parsed,
+            'error': self.error,
+        }
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if force or now - self.reported >= self.REPORT_INTERVAL:
+            self.reported = now
+            self.store()
+            group_send_sync(self.room_name, 'import_progress', self.to_representation())
+
+    def store(self):
+        ImportStatus.objects.update_or_create(job=self.id, defaults={'status': self.to_representation()})
+
+    def set_state(self, state):
+        self.state = state
+        self.report(force=True)
+
+    def extracted(self, extracted, total):
+        self.bytes_extracted, self.bytes_total = extracted, total
+        self.report()
+
+    def parsed(self, count=1):
+        self.questions_parsed += count
+        self.report()
+
+
+class ImportQueue:
+    # in-process job queue, the status of a job is stored for requests that land on other workers
+    def __init__(self, workers, keep_time):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='imports')
+        self.keep_time = keep_time
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def get_status(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_representation()
+        return ImportStatus.objects.filter(job=job_id).values_list('status', flat=True).first()
+
+    def clean(self):
+        timeout = time.monotonic() - self.keep_time
+        with self.lock:
+            for job_id, job in list(self.jobs.items()):
+                if job.finished is not None and job.finished < timeout:
+                    del self.jobs[job_id]
+        ImportStatus.objects.filter(updated__lt=timezone.now() - timedelta(seconds=self.keep_time)).delete()
+
+    @staticmethod
+    def keep_upload(file):
+        # the request closes its uploads when it ends, keep our own link to the data
+        path = os.path.join(settings.FILE_UPLOAD_TEMP_DIR or tempfile.gettempdir(), f'import-{uuid.uuid4().hex}')
+        if hasattr(file, 'temporary_file_path'):
+            try:
+                os.link(file.temporary_file_path(), path)
+                return path
+            except OSError:
+                pass
+        file.seek(0)
+        with open(path, 'wb') as dest:
+            shutil.copyfileobj(file, dest, CHUNK_SIZE)
+        return path
+
+    def submit(self, job, func, filename):
+        self.clean()
+        with self.lock:
+            self.jobs[job.id] = job
+        job.store()
+        self.executor.submit(self.run, job, func, filename)
+        return job
+
+    def defer(self, func, *args):
+        # follow-up work of a finished import, shares the import workers
+        self.executor.submit(self.run_deferred, func, *args)
+
+    @staticmethod
+    def run_deferred(func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            logger.error('%s failed: %s' % (func.__name__, str(e)))
+        finally:
+            connections.close_all()
+
+    @staticmethod
+    def run(job, func, filename):
+        try:
+            func(job, filename)
+            job.finished = time.monotonic()
+            job.set_state(ImportJob.STATE_DONE)
+        except Exception as e:
+            logger.error('Import %s failed: %s' % (job.id, str(e)))
+            job.error = str(e) if isinstance(e, (BadFormatException, BadStateException)) else 'Bad game file'
+            job.finished = time.monotonic()
+            job.set_state(ImportJob.STATE_FAILED)
+        finally:
+            if os.path.exists(filename):
+                os.remove(filename)
+            connections.close_all()
+
+
+import_queue = ImportQueue(settings.GAMES_IMPORT_WORKERS, settings.GAMES_IMPORT_KEEP_TIME)
+
+
+class GameImporter:
+    # imports a game archive with content.xml and its media, the games provide the hooks
+    game_name = None
+    model = None
+    question_model = None
+    serializer_class = None
+
+    @property
+    def media_root(self):
+        raise NotImplementedError()
+
+    def read_pack(self, filename, parsed):
+        # the pack to load, `parsed(count)` reports progress while reading
+        raise NotImplementedError()
+
+    def count_questions(self, pack):
+        raise NotImplementedError()
+
+    def get_questions(self, token):
+        raise NotImplementedError()
+
+    def import_game(self, token, file, load, job=None):
+        directory = os.path.join(self.media_root, token)
+        digest = get_file_digest(file)
+        pack = pack_cache.get(self.game_name, digest, directory)
+        if pack is None:
+            unzip(file, directory, progress=job.extracted if job else None, blobs_dir=settings.MEDIA_ROOT_BLOBS)
+
+        try:
+            if job:
+                job.set_state(ImportJob.STATE_PARSING)
+            if pack is None:
+                pack = self.read_pack(os.path.join(directory, 'content.xml'), job.parsed if job else lambda count: None)
+                os.remove(os.path.join(directory, 'content.xml'))
+                pack_cache.put(self.game_name, digest, pack, directory)
+            elif job:
+                job.parsed(self.count_questions(pack))
+            load(pack)
+        except Exception as e:
+            shutil.rmtree(directory, ignore_errors=True)
+            logger.error(str(e))
+            if isinstance(e, BadFormatException) or isinstance(e, BadStateException):
+                raise e
+            raise BadFormatException("Bad game file")
+
+        if os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+        elif settings.GAMES_MEDIA_OPTIMIZE:
+            transaction.on_commit(lambda: import_queue.defer(self.optimize_game, token))
+
+    def get_game(self, token):
+        # follow-ups run on whichever worker took the upload, not the one serving the room. The row is
+        # written directly, the serving worker loads it again by its version instead of caching a second copy
+        return self.model.objects.select_for_update().get(token=token)
+
+    def optimize_game(self, token):
+        room_name = f'{self.game_name}_{token}'
+        questions = list(self.get_questions(token))
+        fields = self.question_model.OPTIMIZED_FIELDS
+        optimized = transcoder.optimize(os.path.join(self.media_root, token), [
+            getattr(question, field) for question in questions for field, _ in fields
+        ])
+        if not optimized:
+            return
+        for question in questions:
+            for field, optimized_field in fields:
+                setattr(question, optimized_field, optimized.get(getattr(question, field)))
+        self.question_model.objects.bulk_update(questions, [field for _, field in fields], batch_size=500)
+
+        media_manifests.discard(room_name)
+        with transaction.atomic():
+            game = self.get_game(token)
+            data = self.serializer_class().to_representation(game)
+            version = game.bump_version()
+        group_send_sync(room_name, 'game', data, version)
+
+    def import_game_job(self, job, filename):
+        def load(pack):
+            with transaction.atomic():
+                game = self.get_game(job.token)
+                game.load_pack(pack)
+                data = self.serializer_class().to_representation(game)
+                version = game.bump_version()
+            group_send_sync(job.room_name, 'game', data, version)
+
+        job.set_state(ImportJob.STATE_EXTRACTING)
+        try:
+            self.import_game(job.token, filename, load, job)
+        except Exception:
+            shutil.rmtree(os.path.join(self.media_root, job.token), ignore_errors=True)
+            self.model.objects.filter(token=job.token).delete()
+            raise
@@ -0,0 +1,92 @@
+import asyncio
+import random
+import string
+import weakref
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from common.broker import BrokerConnection
+
+
+class BrokerChannelLayer(BaseChannelLayer):
+    extensions = ['groups', 'flush']
+
+    def __init__(self, address='unix:/tmp/bunjgames-broker.sock', expiry=60, capacity=100, channel_capacity=None,
+                 **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.address = address
+        # async_to_sync runs a fresh loop per call in threads without one, its connection goes with the loop
+        self.connections = weakref.WeakKeyDictionary()
+        self.locks = weakref.WeakKeyDictionary()
+
+    async def connection(self):
+        loop = asyncio.get_running_loop()
+        connection = self.connections.get(loop)
+        if connection is not None and not connection.closed:
+            return connection
+        lock = self.locks.setdefault(loop, asyncio.Lock())
+        async with lock:
+            connection = self.connections.get(loop)
+            if connection is None or connection.closed:
+                connection = self.connections[loop] = await BrokerConnection.open(self.address)
+                # the reader stops when the broker goes away or the loop shuts down and cancels it
+                connection.reader_task.add_done_callback(lambda _: self.discard(loop, connection))
+        return connection
+
+    def discard(self, loop, connection):
+        if self.connections.get(loop) is connection:
+            del self.connections[loop]
+            self.locks.pop(loop, None)
+        connection.close()
+
+    @staticmethod
+    def pack(message):
+        assert isinstance(message, dict), 'message is not a dict'
+        return msgpack.packb(message, use_bin_type=True)
+
+    async def send(self, channel, message):
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        connection = await self.connection()
+        if not await connection.call('send', channel, self.pack(message)):
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        connection = await self.connection()
+        request_id, future = connection.request('receive', channel)
+        await connection.drain()
+        try:
+            message = await future
+        except asyncio.CancelledError:
+            if not connection.closed:
+                connection.request('cancel', request_id, reply=False)
+            raise
+        return msgpack.unpackb(message, raw=False)
+
+    async def new_channel(self, prefix='specific.'):
+        return '%s.broker!%s' % (prefix, ''.join(random.choice(string.ascii_letters) for i in range(12)))
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        await (await self.connection()).call('group_add', group, channel)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        await (await self.connection()).call('group_discard', group, channel)
+
+    async def group_send(self, group, message):
+        assert self.valid_group_name(group), 'Group name not valid'
+        connection = await self.connection()
+        connection.request('group_send', group, self.pack(message), reply=False)
+        await connection.drain()
+
+    async def flush(self):
+        await (await self.connection()).call('flush')
+
+    async def close(self):
+        for loop, connection in list(self.connections.items()):
+            self.discard(loop, connection)
@@ -0,0 +1,34 @@
+import os
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from common.management.commands.benchparse import make_jeopardy_pack
+from jeopardy.models import Game
+
+
+class Command(BaseCommand):
+    help = 'Measures peak memory and time of reading a synthetic jeopardy content.xml'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        with tempfile.NamedTemporaryFile(suffix='.xml', delete=False) as file:
+            file.write(make_jeopardy_pack(options['questions']))
+        try:
+            tracemalloc.start()
+            start = time.perf_counter()
+            rounds = Game.read_pack(file.name)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            questions = sum(len(theme['questions']) for round in rounds for theme in round)
+            self.stdout.write('%d questions, %d KB: peak %.1f MB, %.1f ms' % (
+                questions, os.path.getsize(file.name) // 1024, peak / 1024 / 1024, elapsed * 1000
+            ))
+        finally:
+            os.remove(file.name)
@@ -0,0 +1,67 @@
+import datetime
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from common.reaper import reaper
+from weakest.models import Game
+
+
+class Command(BaseCommand):
+    help = 'Measures expiry queries over many historical games with and without the expired index, ' \
+           'nothing is left in the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=1000000)
+        parser.add_argument('--expired', type=float, default=0.01, help='Share of games already expired')
+
+    def measure(self, now):
+        start = time.perf_counter()
+        list(Game.objects.filter(expired__lt=now).order_by('expired').values_list('pk', 'token')[
+            :settings.GAMES_REAPER_BATCH_SIZE
+        ])
+        select = time.perf_counter() - start
+        start = time.perf_counter()
+        count = Game.objects.filter(expired__lt=now).count()
+        return select, time.perf_counter() - start, count
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        total, expired = options['games'], int(options['games'] * options['expired'])
+        with transaction.atomic():
+            start = time.perf_counter()
+            for offset in range(0, total, 10000):
+                Game.objects.bulk_create(Game(
+                    token=f'BENCH{i}',
+                    # expired games are the oldest ones, the rest expire within the next days
+                    expired=now + datetime.timedelta(seconds=(i - expired) * 60 if i < expired else i)
+                ) for i in range(offset, min(offset + 10000, total)))
+            self.stdout.write('%d games, %d expired, inserted in %.1f s' % (
+                total, expired, time.perf_counter() - start
+            ))
+
+            select, count, found = self.measure(now)
+            self.stdout.write('indexed:    batch %8.2f ms, count %8.2f ms (%d)' % (select * 1000, count * 1000, found))
+
+            with tempfile.TemporaryDirectory() as media_root:
+                start = time.perf_counter()
+                games, rows, _ = reaper.reap_batch(Game, media_root, now, settings.GAMES_REAPER_BATCH_SIZE)
+                self.stdout.write('reap batch of %d games, %d rows: %.2f ms' % (
+                    games, rows, (time.perf_counter() - start) * 1000
+                ))
+
+            with connection.cursor() as cursor:
+                constraints = connection.introspection.get_constraints(cursor, Game._meta.db_table)
+                for name, constraint in constraints.items():
+                    if constraint['index'] and constraint['columns'] == ['expired']:
+                        cursor.execute('DROP INDEX %s' % connection.ops.quote_name(name))
+
+            select, count, found = self.measure(now)
+            self.stdout.write('sequential: batch %8.2f ms, count %8.2f ms (%d)' % (
+                select * 1000, count * 1000, found
+            ))
+            transaction.set_rollback(True)
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from common.broadcast import make_event
+from common.broker import Broker
+from common.layers import BrokerChannelLayer
+
+
+class Command(BaseCommand):
+    help = 'Compares group fan-out throughput of the in-memory and broker channel layers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument('--members', type=int, default=20)
+        parser.add_argument('--messages', type=int, default=50)
+        parser.add_argument('--size', type=int, default=4096, help='Game message size in bytes')
+
+    def handle(self, *args, **options):
+        path = os.path.join(tempfile.mkdtemp(), 'broker.sock')
+        started = threading.Event()
+        threading.Thread(
+            target=lambda: asyncio.run(Broker(capacity=options['messages'] + 1).serve(f'unix:{path}', started)),
+            daemon=True
+        ).start()
+        started.wait()
+
+        layers = (
+            ('in-memory', InMemoryChannelLayer(capacity=options['messages'] + 1)),
+            ('broker', BrokerChannelLayer(address=f'unix:{path}', capacity=options['messages'] + 1)),
+        )
+        for name, layer in layers:
+            elapsed = asyncio.run(self.run(layer, **options))
+            sent = options['groups'] * options['messages']
+            delivered = sent * options['members']
+            self.stdout.write('%-10s %8.3fs  %10.0f group sends/s  %10.0f deliveries/s' % (
+                name, elapsed, sent / elapsed, delivered / elapsed
+            ))
+
+    @staticmethod
+    async def run(layer, groups, members, messages, size, **kwargs):
+        event = make_event('game', {'payload': 'x' * size})
+        group_names = [f'bench_{i}' for i in range(groups)]
+        receivers = []
+        for group in group_names:
+            for _ in range(members):
+                channel = await layer.new_channel()
+                await layer.group_add(group, channel)
+                receivers.append(channel)
+
+        async def receive(channel):
+            for _ in range(messages):
+                await layer.receive(channel)
+
+        start = time.perf_counter()
+        tasks = [asyncio.ensure_future(receive(channel)) for channel in receivers]
+        for _ in range(messages):
+            await asyncio.gather(*(layer.group_send(group, event) for group in group_names))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        await layer.flush()
+        await layer.close()
+        return elapsed
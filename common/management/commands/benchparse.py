@@ -0,0 +1,100 @@
+import io
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+import feud.models
+import jeopardy.models
+import weakest.models
+import whirligig.models
+
+
+def make_jeopardy_pack(questions):
+    themes = max(questions // 8, 1)
+    question_xml = (
+        '<question price="{price}"><scenario><atom>Question {price}</atom><atom type="marker"/>'
+        '<atom type="image">@{price}.png</atom></scenario><right><answer>Answer</answer></right>'
+        '<info><comments>Comment</comments></info></question>'
+    )
+    theme_xml = '<theme name="Theme {}"><questions>%s</questions></theme>' % ''.join(
+        question_xml.format(price=(i + 1) * 100) for i in range(8)
+    )
+    rounds = [
+        '<round name="Round {}"><themes>{}</themes></round>'.format(
+            i, ''.join(theme_xml.format(j) for j in range(i * 6, min(i * 6 + 6, themes)))
+        ) for i in range((themes + 5) // 6)
+    ]
+    return (
+        '<?xml version="1.0" encoding="utf-8"?><package xmlns="http://vladimirkhil.com/ygpackage3.0.xsd">'
+        '<rounds>{}</rounds></package>'.format(''.join(rounds))
+    ).encode()
+
+
+def make_weakest_pack(questions):
+    question_xml = '<question><question>Question {0}</question><answer>Answer {0}</answer></question>'
+    return (
+        '<?xml version="1.0" encoding="utf-8"?><game><score_multiplier>1</score_multiplier>'
+        '<questions>{}</questions><final_questions>{}</final_questions></game>'.format(
+            ''.join(question_xml.format(i) for i in range(questions)),
+            ''.join(question_xml.format(i) for i in range(10)),
+        )
+    ).encode()
+
+
+def make_feud_pack(questions):
+    answer_xml = '<answer><text>Answer {0}</text><value>{0}</value></answer>'
+    question_xml = '<question><text>Question</text>%s</question>' % ''.join(answer_xml.format(i) for i in range(6))
+    return (
+        '<?xml version="1.0" encoding="utf-8"?><game>'
+        '<questions>{}</questions><final_questions>{}</final_questions></game>'.format(
+            question_xml * max(questions // 7, 1), question_xml * 5,
+        )
+    ).encode()
+
+
+def make_whirligig_pack(questions):
+    question_xml = (
+        '<question><description>Description</description><text>Question</text>'
+        '<image/><audio/><video/><answer><description>Description</description>'
+        '<text>Answer</text><image/><audio/><video/></answer></question>'
+    )
+    item_xml = '<item><name>Item</name><type>standard</type><questions>%s</questions></item>' % (question_xml * 3)
+    return '<?xml version="1.0" encoding="utf-8"?><game><items>{}</items></game>'.format(item_xml * 13).encode()
+
+
+PACKS = {
+    'jeopardy': (jeopardy.models.Game, make_jeopardy_pack),
+    'weakest': (weakest.models.Game, make_weakest_pack),
+    'feud': (feud.models.Game, make_feud_pack),
+    'whirligig': (whirligig.models.Game, make_whirligig_pack),
+}
+
+
+class Command(BaseCommand):
+    help = 'Measures parsing of synthetic game packs, nothing is left in the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=5000, help='Rows per pack, approximately')
+        parser.add_argument('--game', choices=list(PACKS), action='append')
+
+    def handle(self, *args, **options):
+        for name in options['game'] or PACKS:
+            model, make_pack = PACKS[name]
+            # whirligig packs are capped at 13 items by 3 questions, parse enough of them instead
+            games = max(options['questions'] // 39, 1) if name == 'whirligig' else 1
+            data = make_pack(options['questions'])
+
+            with transaction.atomic():
+                instances = [model.new() for _ in range(games)]
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    for game in instances:
+                        game.parse(io.BytesIO(data))
+                    elapsed = time.perf_counter() - start
+                transaction.set_rollback(True)
+
+            self.stdout.write('%-9s %6d KB x %d: %8.1f ms, %d queries' % (
+                name, len(data) // 1024, games, elapsed * 1000, len(queries)
+            ))
@@ -0,0 +1,75 @@
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.management.base import BaseCommand
+
+from common.utils import unzip, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Measures peak RSS of extracting an uploaded game pack, buffered in memory versus streamed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=200, help='Media size of the pack in MB')
+        parser.add_argument('--mode', choices=('buffered', 'streamed'), help='Run a single mode on --archive')
+        parser.add_argument('--archive')
+
+    def handle(self, *args, **options):
+        if options['mode']:
+            return self.run(options['mode'], options['archive'])
+
+        directory = tempfile.mkdtemp()
+        try:
+            archive = os.path.join(directory, 'pack.zip')
+            self.create_pack(archive, options['size'])
+            for mode in ('buffered', 'streamed'):
+                output = subprocess.check_output([
+                    sys.executable, sys.argv[0], 'benchupload', '--mode', mode, '--archive', archive
+                ], stderr=subprocess.DEVNULL)
+                self.stdout.write(output.decode().strip())
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @staticmethod
+    def create_pack(archive, size):
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as pack:
+            pack.writestr('content.xml', '<?xml version="1.0" encoding="utf-8"?><package/>')
+            with pack.open('Video/video.mp4', 'w', force_zip64=True) as video:
+                for _ in range(size):
+                    video.write(os.urandom(CHUNK_SIZE))
+
+    def run(self, mode, archive):
+        directory = tempfile.mkdtemp()
+        try:
+            upload = TemporaryUploadedFile('pack.zip', 'application/zip', os.path.getsize(archive), None)
+            with open(archive, 'rb') as source:
+                shutil.copyfileobj(source, upload, CHUNK_SIZE)
+            upload.seek(0)
+
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start = time.perf_counter()
+            if mode == 'buffered':
+                storage = FileSystemStorage(location=directory)
+                file = storage.path(storage.save('game', ContentFile(upload.read())))
+                unzip(file, os.path.join(directory, 'pack'))
+                os.remove(file)
+            else:
+                unzip(upload, os.path.join(directory, 'pack'))
+            elapsed = time.perf_counter() - start
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            upload.close()
+
+            self.stdout.write('%-9s peak RSS %7.1f MB (+%.1f MB), %.2fs' % (
+                mode, peak / 1024, (peak - before) / 1024, elapsed
+            ))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
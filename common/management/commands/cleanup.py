@@ -1,27 +1,22 @@
-import os
-import shutil
+import time
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db import transaction
-from django.utils import timezone
 
-from whirligig.models import Game as WhirligigGame
-from jeopardy.models import Game as JeopardyGame
-from weakest.models import Game as WeakestGame
+from common.reaper import reaper
 
 
 class Command(BaseCommand):
-    @transaction.atomic
-    def handle(self, *args, **options):
-        expired_whirligig_games = WhirligigGame.objects.filter(expired__lt=timezone.now())
-        for game in expired_whirligig_games.iterator():
-            shutil.rmtree(os.path.join(settings.MEDIA_ROOT_WHIRLIGIG, game.token), ignore_errors=True)
-        expired_whirligig_games.delete()
+    help = 'Deletes expired games of all apps with their media in small batches'
 
-        expired_jeopardy_games = JeopardyGame.objects.filter(expired__lt=timezone.now())
-        for game in expired_jeopardy_games.iterator():
-            shutil.rmtree(os.path.join(settings.MEDIA_ROOT_JEOPARDY, game.token), ignore_errors=True)
-        expired_jeopardy_games.delete()
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.GAMES_REAPER_BATCH_SIZE)
+        parser.add_argument('--interval', type=int, default=0, help='Keep running, reaping every N seconds')
 
-        WeakestGame.objects.filter(expired__lt=timezone.now())
+    def handle(self, *args, **options):
+        while True:
+            total = reaper.reap(options['batch_size'])
+            self.stdout.write('%(games)d games, %(rows)d rows, %(blobs)d blobs, %(bytes)d bytes reclaimed' % total)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
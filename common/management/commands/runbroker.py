@@ -0,0 +1,20 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from common.broker import Broker
+
+
+class Command(BaseCommand):
+    help = 'Runs the message broker used by BrokerChannelLayer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', default='unix:/tmp/bunjgames-broker.sock')
+        parser.add_argument('--capacity', type=int, default=100)
+        parser.add_argument('--expiry', type=int, default=60)
+        parser.add_argument('--group-expiry', type=int, default=86400)
+
+    def handle(self, *args, **options):
+        broker = Broker(capacity=options['capacity'], expiry=options['expiry'], group_expiry=options['group_expiry'])
+        self.stdout.write(f"Broker listening on {options['bind']}")
+        asyncio.run(broker.serve(options['bind']))
@@ -0,0 +1,56 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from common.router import RoomRouter
+
+
+class Command(BaseCommand):
+    help = 'Runs game workers behind a router that keeps every room on one worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', default='0.0.0.0:8000')
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--backend', action='append', default=[],
+                            help='Already running worker address, host:port or unix:/path')
+        parser.add_argument('--socket-dir', default=tempfile.gettempdir())
+
+    def handle(self, *args, **options):
+        # create and import follow-ups run on any worker, their broadcasts need the shared broker
+        if settings.CHANNEL_LAYERS['default']['BACKEND'] != 'common.layers.BrokerChannelLayer':
+            raise CommandError('Workers behind the router need a shared channel layer, set BUNJGAMES_BROKER')
+        host, port = options['bind'].rsplit(':', 1)
+        backends = options['backend']
+        processes = {}
+        if not backends:
+            for i in range(options['workers']):
+                path = os.path.join(options['socket_dir'], f'bunjgames-worker-{i}.sock')
+                backends.append(f'unix:{path}')
+                processes[path] = self.spawn(path)
+        try:
+            asyncio.run(self.run(RoomRouter(backends), host, int(port), processes))
+        finally:
+            for process in processes.values():
+                process.terminate()
+
+    @staticmethod
+    def spawn(path):
+        if os.path.exists(path):
+            os.remove(path)
+        return subprocess.Popen([sys.executable, '-m', 'daphne', '-u', path, 'bunjgames_server.asgi:application'])
+
+    async def run(self, router, host, port, processes):
+        server = asyncio.ensure_future(router.serve(host, port))
+        self.stdout.write(f'Routing {host}:{port} to {len(router.backends)} workers')
+        while not server.done():
+            await asyncio.sleep(1)
+            for path, process in processes.items():
+                if process.poll() is not None:
+                    self.stderr.write(f'Worker {path} exited with {process.returncode}, restarting')
+                    processes[path] = self.spawn(path)
+        server.result()
@@ -0,0 +1,195 @@
+import asyncio
+import mimetypes
+import os
+import re
+import stat
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+
+from django.conf import settings
+from django.utils.http import http_date, parse_http_date_safe
+
+from common.utils import CHUNK_SIZE
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    # single byte range as (start, end), None to send the whole file, ValueError when unsatisfiable
+    match = RANGE.match(header or '')
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        if int(last) == 0 or size == 0:
+            raise ValueError('Unsatisfiable range')
+        return max(size - int(last), 0), size - 1
+    start, end = int(first), int(last) if last else size - 1
+    if end < start and last:
+        return None
+    if start >= size:
+        raise ValueError('Unsatisfiable range')
+    return start, min(end, size - 1)
+
+
+def is_not_modified(headers, etag, modified):
+    if 'if-none-match' in headers:
+        tags = [tag.strip() for tag in headers['if-none-match'].split(',')]
+        return '*' in tags or etag in tags or f'W/{etag}' in tags
+    since = parse_http_date_safe(headers.get('if-modified-since', ''))
+    return since is not None and modified <= since
+
+
+class MediaApplication:
+    # serves MEDIA_ROOT with ranges, validators and long caching, the pack cache stays private
+    async def __call__(self, scope, receive, send):
+        if scope['method'] not in ('GET', 'HEAD'):
+            return await self.respond(send, 405, {'Allow': 'GET, HEAD'})
+
+        path = self.resolve(scope['path'])
+        try:
+            file_stat = os.stat(path) if path else None
+        except (OSError, ValueError):
+            file_stat = None
+        if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
+            return await self.respond(send, 404)
+
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        modified = int(file_stat.st_mtime)
+        etag = '"%x-%x-%x"' % (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
+        content_type, encoding = mimetypes.guess_type(path)
+        response_headers = {
+            'Accept-Ranges': 'bytes',
+            'Cache-Control': f'public, max-age={settings.MEDIA_MAX_AGE}',
+            'ETag': etag,
+            'Last-Modified': http_date(modified),
+        }
+
+        if settings.MEDIA_ACCEL_REDIRECT:
+            relative = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+            response_headers['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT + quote(relative)
+            response_headers['Content-Type'] = content_type or 'application/octet-stream'
+            return await self.respond(send, 200, response_headers)
+
+        if is_not_modified(headers, etag, modified):
+            return await self.respond(send, 304, response_headers)
+
+        response_headers['Content-Type'] = content_type or 'application/octet-stream'
+        if encoding:
+            response_headers['Content-Encoding'] = encoding
+
+        status, start, length = 200, 0, file_stat.st_size
+        if_range = headers.get('if-range')
+        if if_range is None or if_range in (etag, response_headers['Last-Modified']):
+            try:
+                byte_range = parse_range(headers.get('range'), file_stat.st_size)
+            except ValueError:
+                response_headers['Content-Range'] = f'bytes */{file_stat.st_size}'
+                return await self.respond(send, 416, response_headers)
+            if byte_range is not None:
+                status, start, length = 206, byte_range[0], byte_range[1] - byte_range[0] + 1
+                response_headers['Content-Range'] = f'bytes {byte_range[0]}-{byte_range[1]}/{file_stat.st_size}'
+        response_headers['Content-Length'] = str(length)
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in response_headers.items()],
+        })
+        if scope['method'] == 'HEAD' or length == 0:
+            return await send({'type': 'http.response.body', 'body': b''})
+        await self.send_file(scope, send, path, start, length, file_stat.st_size)
+
+    @staticmethod
+    def resolve(url_path):
+        root = os.path.realpath(settings.MEDIA_ROOT)
+        relative = url_path[len(settings.MEDIA_URL):]
+        if '\x00' in relative:
+            # a percent-encoded NUL, no file can have it in its name
+            return None
+        path = os.path.realpath(os.path.join(root, *relative.split('/')))
+        if not path.startswith(root + os.sep):
+            return None
+        # the stores behind game media are private, blobs hold extracted content.xml files with the answers
+        for private in (settings.MEDIA_ROOT_PACKS, settings.MEDIA_ROOT_BLOBS, settings.MEDIA_ROOT_RENDITIONS):
+            private = os.path.realpath(private)
+            if path == private or path.startswith(private + os.sep):
+                return None
+        return path
+
+    @staticmethod
+    async def respond(send, status, headers=None):
+        headers = dict(headers or {})
+        if status != 304:
+            headers['Content-Length'] = '0'
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': b''})
+
+    @staticmethod
+    async def send_file(scope, send, path, start, length, size):
+        extensions = scope.get('extensions') or {}
+        if 'http.response.pathsend' in extensions and start == 0 and length == size:
+            return await send({'type': 'http.response.pathsend', 'path': path})
+
+        with open(path, 'rb') as file:
+            if 'http.response.zerocopysend' in extensions:
+                # the server hands the descriptor to os.sendfile
+                return await send({
+                    'type': 'http.response.zerocopysend', 'file': file, 'offset': start, 'count': length
+                })
+
+            loop = asyncio.get_running_loop()
+            offset, end = start, start + length
+            while offset < end:
+                chunk = await loop.run_in_executor(None, os.pread, file.fileno(), min(CHUNK_SIZE, end - offset), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': offset < end})
+            if offset < end:
+                await send({'type': 'http.response.body', 'body': b''})
+
+
+class MediaRouter:
+    def __init__(self, application):
+        self.application = application
+        self.media = MediaApplication()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'].startswith(settings.MEDIA_URL):
+            return await self.media(scope, receive, send)
+        return await self.application(scope, receive, send)
+
+
+class MediaManifests:
+    # media each room is about to show, computed once per room and key (a round, the item list)
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.manifests = OrderedDict()
+
+    def get(self, room_name, key, compute):
+        with self.lock:
+            manifest = self.manifests.get((room_name, key))
+            if manifest is not None:
+                self.manifests.move_to_end((room_name, key))
+                return manifest, False
+        manifest = compute()
+        with self.lock:
+            self.manifests[(room_name, key)] = manifest
+            while len(self.manifests) > self.size:
+                self.manifests.popitem(last=False)
+        return manifest, True
+
+    def discard(self, room_name):
+        with self.lock:
+            for key in [key for key in self.manifests if key[0] == room_name]:
+                del self.manifests[key]
+
+
+media_manifests = MediaManifests(settings.GAMES_MANIFESTS_CACHE_SIZE)
@@ -0,0 +1,19 @@
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def get(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+metrics = Metrics()
@@ -0,0 +1,8 @@
+from django.db import models
+
+
+class ImportStatus(models.Model):
+    # last reported state of an import job, readable from every worker
+    job = models.CharField(max_length=32, primary_key=True)
+    status = models.JSONField()
+    updated = models.DateTimeField(auto_now=True, db_index=True)
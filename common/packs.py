@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+
+from common.metrics import metrics
+from common.utils import link_tree
+
+logger = logging.getLogger(__name__)
+
+# part of every cache key, bump it when a pack parser changes what it reads
+PACK_FORMAT = 1
+
+
+class PackCache:
+    # parsed pack records and hard links to their media, keyed by the archive digest.
+    # entry sizes are kept in an LRU index, the cache tree is only walked once per process
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = None
+        self.index_root = None
+        self.total = 0
+
+    @property
+    def root(self):
+        return settings.MEDIA_ROOT_PACKS
+
+    @property
+    def max_size(self):
+        return settings.GAMES_PACK_CACHE_SIZE
+
+    def get_path(self, game_name, digest):
+        return os.path.join(self.root, game_name, f'{digest}-v{PACK_FORMAT}')
+
+    def get(self, game_name, digest, media_dir=None):
+        path = self.get_path(game_name, digest)
+        try:
+            with open(os.path.join(path, 'pack.json')) as file:
+                pack = json.load(file)
+            if media_dir is not None and os.path.isdir(os.path.join(path, 'media')):
+                link_tree(os.path.join(path, 'media'), media_dir)
+            os.utime(os.path.join(path, 'pack.json'))
+            self.touch(path)
+        except (OSError, ValueError):
+            if media_dir is not None:
+                shutil.rmtree(media_dir, ignore_errors=True)
+            metrics.increment('pack_cache_misses')
+            return None
+        metrics.increment('pack_cache_hits')
+        return pack
+
+    def put(self, game_name, digest, pack, media_dir=None):
+        path = self.get_path(game_name, digest)
+        if os.path.exists(path):
+            return
+        temp = os.path.join(self.root, game_name, f'.{digest}.{uuid.uuid4().hex}')
+        try:
+            os.makedirs(temp)
+            if media_dir is not None and os.path.isdir(media_dir):
+                link_tree(media_dir, os.path.join(temp, 'media'))
+            with open(os.path.join(temp, 'pack.json'), 'w') as file:
+                json.dump(pack, file)
+            os.rename(temp, path)
+        except OSError as e:
+            logger.warning('Pack %s is not cached: %s' % (digest, str(e)))
+            shutil.rmtree(temp, ignore_errors=True)
+            return
+        self.touch(path)
+        self.evict()
+
+    @staticmethod
+    def get_size(path):
+        size = 0
+        for directory, _, files in os.walk(path):
+            for name in files:
+                size += os.lstat(os.path.join(directory, name)).st_size
+        return size
+
+    def load_index(self):
+        # entries in the order they were last used, as recorded by the mtime of pack.json
+        entries = []
+        if os.path.isdir(self.root):
+            for game_name in os.listdir(self.root):
+                for digest in os.listdir(os.path.join(self.root, game_name)):
+                    path = os.path.join(self.root, game_name, digest)
+                    if digest.startswith('.'):
+                        continue
+                    try:
+                        used = os.stat(os.path.join(path, 'pack.json')).st_mtime
+                    except OSError:
+                        used = 0
+                    entries.append((used, path, self.get_size(path)))
+        self.index = OrderedDict((path, size) for _, path, size in sorted(entries))
+        self.index_root = self.root
+        self.total = sum(self.index.values())
+
+    def get_index(self):
+        if self.index is None or self.index_root != self.root:
+            self.load_index()
+        return self.index
+
+    def touch(self, path):
+        with self.lock:
+            index = self.get_index()
+            if path in index:
+                index.move_to_end(path)
+                return
+        # an entry of another worker, or the new one, is measured once
+        size = self.get_size(path)
+        with self.lock:
+            index = self.get_index()
+            if path not in index:
+                index[path] = size
+                self.total += size
+
+    def evict(self):
+        with self.lock:
+            index = self.get_index()
+            evicted = []
+            while self.total > self.max_size and index:
+                path, size = index.popitem(last=False)
+                self.total -= size
+                evicted.append(path)
+        for path in evicted:
+            shutil.rmtree(path, ignore_errors=True)
+            metrics.increment('pack_cache_evictions')
+
+
+pack_cache = PackCache()
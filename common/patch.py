@@ -0,0 +1,60 @@
+import copy
+
+
+def escape(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def unescape(token):
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def is_same(old, new):
+    return type(old) is type(new) and old == new
+
+
+def diff(old, new, path=''):
+    if isinstance(old, dict) and isinstance(new, dict):
+        patch = []
+        for key in old:
+            if key not in new:
+                patch.append({'op': 'remove', 'path': f'{path}/{escape(key)}'})
+        for key, value in new.items():
+            if key not in old:
+                patch.append({'op': 'add', 'path': f'{path}/{escape(key)}', 'value': value})
+            else:
+                patch += diff(old[key], value, f'{path}/{escape(key)}')
+        return patch
+    if isinstance(old, list) and isinstance(new, list):
+        patch = []
+        for index in range(min(len(old), len(new))):
+            patch += diff(old[index], new[index], f'{path}/{index}')
+        for index in range(len(old), len(new)):
+            patch.append({'op': 'add', 'path': f'{path}/{index}', 'value': new[index]})
+        for index in reversed(range(len(new), len(old))):
+            patch.append({'op': 'remove', 'path': f'{path}/{index}'})
+        return patch
+    if is_same(old, new):
+        return []
+    return [{'op': 'replace', 'path': path, 'value': new}]
+
+
+def apply(document, patch):
+    document = copy.deepcopy(document)
+    for operation in patch:
+        if not operation['path']:
+            document = copy.deepcopy(operation['value'])
+            continue
+        *parents, last = [unescape(token) for token in operation['path'].split('/')[1:]]
+        target = document
+        for token in parents:
+            target = target[int(token)] if isinstance(target, list) else target[token]
+        if isinstance(target, list):
+            last = int(last)
+        if operation['op'] == 'remove':
+            del target[last]
+        elif operation['op'] == 'add' and isinstance(target, list):
+            target.insert(last, copy.deepcopy(operation['value']))
+        else:
+            target[last] = copy.deepcopy(operation['value'])
+    return document
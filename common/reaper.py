@@ -0,0 +1,109 @@
+import logging
+import os
+import shutil
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from common.engine import game_engine
+from common.metrics import metrics
+from common.utils import clean_blobs
+
+logger = logging.getLogger(__name__)
+
+
+def get_tree_size(directory):
+    # files still linked from the blob store are only reclaimed by clean_blobs
+    size = 0
+    for path, _, files in os.walk(directory):
+        for name in files:
+            stat = os.lstat(os.path.join(path, name))
+            if stat.st_nlink == 1:
+                size += stat.st_size
+    return size
+
+
+class Reaper:
+    # deletes expired games in small batches, each batch is its own short transaction
+    def __init__(self):
+        self.thread = None
+
+    @staticmethod
+    def get_targets():
+        from feud.models import Game as FeudGame
+        from jeopardy.models import Game as JeopardyGame
+        from weakest.models import Game as WeakestGame
+        from whirligig.models import Game as WhirligigGame
+
+        return (
+            (WhirligigGame, settings.MEDIA_ROOT_WHIRLIGIG),
+            (JeopardyGame, settings.MEDIA_ROOT_JEOPARDY),
+            (WeakestGame, settings.MEDIA_ROOT_WEAKEST),
+            (FeudGame, settings.MEDIA_ROOT_FEUD),
+        )
+
+    @staticmethod
+    def reap_batch(model, media_root, now, batch_size):
+        with transaction.atomic():
+            games = list(
+                model.objects.filter(expired__lt=now).order_by('expired')
+                .select_for_update(skip_locked=True).values_list('pk', 'token')[:batch_size]
+            )
+            if not games:
+                return 0, 0, 0
+            rows, _ = model.objects.filter(pk__in=[pk for pk, _ in games]).delete()
+
+        reclaimed = 0
+        for _, token in games:
+            # rooms are named after the app of their game
+            game_engine.discard(f'{model._meta.app_label}_{token}')
+            directory = os.path.join(media_root, token)
+            if os.path.isdir(directory):
+                reclaimed += get_tree_size(directory)
+                shutil.rmtree(directory, ignore_errors=True)
+        return len(games), rows, reclaimed
+
+    def reap(self, batch_size=None):
+        batch_size = batch_size or settings.GAMES_REAPER_BATCH_SIZE
+        now = timezone.now()
+        total = dict(games=0, rows=0, bytes=0, blobs=0)
+        for model, media_root in self.get_targets():
+            while True:
+                games, rows, reclaimed = self.reap_batch(model, media_root, now, batch_size)
+                total['games'] += games
+                total['rows'] += rows
+                total['bytes'] += reclaimed
+                if games < batch_size:
+                    break
+
+        total['blobs'], reclaimed = clean_blobs(settings.MEDIA_ROOT_BLOBS)
+        total['bytes'] += reclaimed
+        renditions, reclaimed = clean_blobs(settings.MEDIA_ROOT_RENDITIONS)
+        total['blobs'] += renditions
+        total['bytes'] += reclaimed
+
+        for name, value in total.items():
+            metrics.increment(f'reaper_{name}', value)
+        return total
+
+    def start(self):
+        if not settings.GAMES_REAPER_INTERVAL or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run, name='games-reaper', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(settings.GAMES_REAPER_INTERVAL)
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error('Reaper failed: %s' % str(e))
+            finally:
+                close_old_connections()
+
+
+reaper = Reaper()
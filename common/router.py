@@ -0,0 +1,242 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import json
+import logging
+import re
+import time
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+ROOM_PATH = re.compile(r'^/(?P<game>\w+)/ws/(?P<token>\w+)/?$')
+REGISTER_PATH = re.compile(r'^/(?P<game>\w+)/v1/(players|teams)/register/?$')
+MULTIPART_TOKEN = re.compile(rb'name="token"\r\n\r\n([^\r\n]*)')
+
+MAX_HEAD_SIZE = 64 * 1024
+MAX_BODY_SIZE = 64 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class HashRing:
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self.hashes = []
+        self.nodes = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def hash(key):
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def add(self, node):
+        for i in range(self.replicas):
+            point = self.hash(f'{node}#{i}')
+            if point not in self.nodes:
+                bisect.insort(self.hashes, point)
+            self.nodes[point] = node
+
+    def remove(self, node):
+        for i in range(self.replicas):
+            point = self.hash(f'{node}#{i}')
+            if self.nodes.get(point) == node:
+                del self.nodes[point]
+                self.hashes.remove(point)
+
+    def get(self, key):
+        if not self.hashes:
+            return None
+        index = bisect.bisect(self.hashes, self.hash(key)) % len(self.hashes)
+        return self.nodes[self.hashes[index]]
+
+
+def parse_token(content_type, body):
+    try:
+        if content_type.startswith('application/json'):
+            token = json.loads(body).get('token')
+        elif content_type.startswith('application/x-www-form-urlencoded'):
+            token = parse_qs(body.decode()).get('token', [None])[0]
+        elif content_type.startswith('multipart/form-data'):
+            match = MULTIPART_TOKEN.search(body)
+            token = match.group(1).decode() if match else None
+        else:
+            token = None
+    except (ValueError, AttributeError, UnicodeDecodeError):
+        return None
+    return token if isinstance(token, str) else None
+
+
+def get_room_name(path, headers, body=b''):
+    path = path.split('?', 1)[0]
+    match = ROOM_PATH.match(path)
+    if match:
+        return f"{match['game']}_{match['token'].upper().strip()}"
+    match = REGISTER_PATH.match(path)
+    if match:
+        token = parse_token(headers.get('content-type', ''), body)
+        if token:
+            return f"{match['game']}_{token.upper().strip()}"
+    return None
+
+
+def parse_head(head):
+    lines = head.decode('latin-1').split('\r\n')
+    method, path, version = lines[0].split(' ', 2)
+    headers = [tuple(line.split(':', 1)) for line in lines[1:] if ':' in line]
+    return method, path, version, [(name.strip(), value.strip()) for name, value in headers]
+
+
+def build_head(method, path, version, headers):
+    lines = [f'{method} {path} {version}'] + [f'{name}: {value}' for name, value in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+async def open_backend(backend):
+    if backend.startswith('unix:'):
+        return await asyncio.open_unix_connection(backend[len('unix:'):])
+    host, port = backend.rsplit(':', 1)
+    return await asyncio.open_connection(host, int(port))
+
+
+async def pipe(reader, writer):
+    while True:
+        data = await reader.read(CHUNK_SIZE)
+        if not data:
+            break
+        writer.write(data)
+        await writer.drain()
+
+
+class Assignment:
+    def __init__(self, backend):
+        self.backend = backend
+        self.connections = 0
+        self.released = time.monotonic()
+
+
+class RoomRouter:
+    # rooms stay on the worker serving them until it has had no connections for `drain_time`,
+    # a worker coming back only gets its rooms once the worker that took them over let them go
+    def __init__(self, backends, check_interval=1, drain_time=5):
+        self.backends = list(backends)
+        self.alive = set(self.backends)
+        self.ring = HashRing(self.backends)
+        self.check_interval = check_interval
+        self.drain_time = drain_time
+        self.counter = itertools.count()
+        self.rooms = {}
+
+    def is_drained(self, assignment):
+        return not assignment.connections and time.monotonic() - assignment.released >= self.drain_time
+
+    def pick(self, room_name):
+        if room_name is not None:
+            assignment = self.rooms.get(room_name)
+            if assignment is not None and assignment.backend in self.alive and not self.is_drained(assignment):
+                return assignment.backend
+            return self.ring.get(room_name)
+        alive = sorted(self.alive)
+        return alive[next(self.counter) % len(alive)] if alive else None
+
+    def acquire(self, room_name, backend):
+        assignment = self.rooms.get(room_name)
+        if assignment is None or assignment.backend != backend:
+            assignment = self.rooms[room_name] = Assignment(backend)
+        assignment.connections += 1
+        return assignment
+
+    def release(self, assignment):
+        assignment.connections -= 1
+        if not assignment.connections:
+            assignment.released = time.monotonic()
+
+    def clean(self):
+        for room_name, assignment in list(self.rooms.items()):
+            if self.is_drained(assignment):
+                del self.rooms[room_name]
+
+    def mark_dead(self, backend):
+        if backend in self.alive:
+            logger.warning('Backend %s is down, moving its rooms' % backend)
+            self.alive.remove(backend)
+            self.ring.remove(backend)
+
+    def mark_alive(self, backend):
+        if backend not in self.alive:
+            logger.info('Backend %s is up' % backend)
+            self.alive.add(backend)
+            self.ring.add(backend)
+
+    async def connect(self, room_name):
+        while True:
+            backend = self.pick(room_name)
+            if backend is None:
+                raise ConnectionError('No backends alive')
+            try:
+                return backend, await open_backend(backend)
+            except OSError:
+                self.mark_dead(backend)
+
+    async def handle(self, reader, writer):
+        backend_writer = assignment = None
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+            method, path, version, headers = parse_head(head)
+            lowered = {name.lower(): value for name, value in headers}
+
+            body = b''
+            length = int(lowered.get('content-length', 0) or 0)
+            if REGISTER_PATH.match(path.split('?', 1)[0]) and 0 < length <= MAX_BODY_SIZE:
+                body = await reader.readexactly(length)
+            room_name = get_room_name(path, lowered, body)
+
+            if lowered.get('upgrade', '').lower() != 'websocket':
+                headers = [
+                    (name, value) for name, value in headers if name.lower() not in ('connection', 'keep-alive')
+                ] + [('Connection', 'close')]
+
+            backend, (backend_reader, backend_writer) = await self.connect(room_name)
+            if room_name is not None:
+                assignment = self.acquire(room_name, backend)
+            backend_writer.write(build_head(method, path, version, headers) + body)
+
+            pipes = [
+                asyncio.ensure_future(pipe(reader, backend_writer)),
+                asyncio.ensure_future(pipe(backend_reader, writer)),
+            ]
+            try:
+                await asyncio.wait(pipes, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in pipes:
+                    task.cancel()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError) as e:
+            logger.debug('Router connection failed: %s' % str(e))
+        finally:
+            if assignment is not None:
+                self.release(assignment)
+            for stream in (backend_writer, writer):
+                if stream is not None:
+                    stream.close()
+
+    async def check(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            self.clean()
+            for backend in set(self.backends) - self.alive:
+                try:
+                    _, backend_writer = await open_backend(backend)
+                    backend_writer.close()
+                    self.mark_alive(backend)
+                except OSError:
+                    pass
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEAD_SIZE)
+        checker = asyncio.ensure_future(self.check())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            checker.cancel()
@@ -0,0 +1,12 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryCountMixin:
+    consumer_class = None
+
+    def count_queries(self, game):
+        consumer = self.consumer_class()
+        with CaptureQueriesContext(connection) as queries:
+            data = consumer.serialize_game(consumer.get_game(game.token))
+        return len(queries), data
@@ -0,0 +1,921 @@
+import asyncio
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from collections import deque
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from channels.routing import URLRouter
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import re_path
+from django.utils import timezone
+
+from common import patch
+from common.broadcast import broadcast_scheduler, group_send_sync, make_batch_event, make_event, make_game_event
+from common.broadcast import snapshots, transition_events, SnapshotStore
+from common.bulk import BulkLoader
+from common.buttons import ButtonArbiter
+from common.broker import Broker
+from common.engine import game_engine
+from common.layers import BrokerChannelLayer
+from common.media import MediaApplication
+from common.metrics import metrics
+from common.packs import PackCache
+from common.reaper import reaper
+from common.timers import TimerWheel
+from common.wire import WIRE_FORMATS
+from common.router import HashRing, RoomRouter, get_room_name
+from common.utils import BadStateException, NothingToDoException, clean_blobs, unzip
+import feud.models
+import jeopardy.models
+import whirligig.models
+from feud.consumers import FeudConsumer
+from weakest.consumers import WeakestConsumer
+from weakest.models import Game, Player
+
+
+application = URLRouter([
+    re_path(r'weakest/ws/(?P<token>\w+)$', WeakestConsumer.as_asgi()),
+    re_path(r'feud/ws/(?P<token>\w+)$', FeudConsumer.as_asgi()),
+])
+
+
+class BroadcastTestCase(SimpleTestCase):
+
+    def test_make_event(self):
+        event = make_event('game', {'state': 'intro'})
+        self.assertEqual(event['type'], 'game')
+        self.assertEqual(json.loads(event['frame']), {'type': 'game', 'message': {'state': 'intro'}})
+
+    def test_encode_binary(self):
+        self.assertEqual(make_event('intercom', 'right')['frames'], {})
+        with override_settings(GAMES_WIRE_FORMATS=['msgpack']):
+            frames = make_event('intercom', 'right')['frames']
+        self.assertEqual(WIRE_FORMATS['msgpack'].decode(frames['msgpack']), {'type': 'intercom', 'message': 'right'})
+
+    def test_transition_events(self):
+        with transition_events.collect('room') as events:
+            group_send_sync('room', 'intercom', 'right')
+        self.assertEqual(events, [make_event('intercom', 'right')])
+
+    def test_make_batch_event(self):
+        game = lambda version: {'type': 'game', 'version': version, 'frame': str(version)}
+        intercom = make_event('intercom', 'right')
+        self.assertEqual(make_batch_event([game(1)]), game(1))
+        self.assertEqual(make_batch_event([game(1), game(2), intercom, game(3)]), {
+            'type': 'batch', 'events': [game(2), intercom, game(3)]
+        })
+
+
+class WireFormatTestCase(SimpleTestCase):
+
+    def test_join(self):
+        for name, wire_format in WIRE_FORMATS.items():
+            for count in (1, 20, 300):
+                payloads = [{'type': 'intercom', 'message': i} for i in range(count)]
+                frame = wire_format.join([wire_format.encode(payload) for payload in payloads])
+                self.assertEqual(wire_format.decode(frame), {'type': 'batch', 'message': payloads}, name)
+
+
+class PatchTestCase(SimpleTestCase):
+
+    def test_diff_and_apply(self):
+        old = {
+            'state': 'questions',
+            'question': None,
+            'themes': [{'id': 1, 'questions': [{'id': 1, 'is_processed': False}, {'id': 2, 'is_processed': False}]}],
+            'players': [{'id': 1, 'balance': 0}, {'id': 2, 'balance': 0}],
+            'a/b~c': 1,
+        }
+        new = {
+            'state': 'question',
+            'question': {'id': 2},
+            'themes': [{'id': 1, 'questions': [{'id': 1, 'is_processed': False}, {'id': 2, 'is_processed': True}]}],
+            'players': [{'id': 1, 'balance': 1}],
+            'a/b~c': True,
+        }
+        operations = patch.diff(old, new)
+        self.assertEqual(patch.apply(old, operations), new)
+        self.assertIn({'op': 'replace', 'path': '/themes/0/questions/1/is_processed', 'value': True}, operations)
+        self.assertIn({'op': 'replace', 'path': '/a~1b~0c', 'value': True}, operations)
+        self.assertEqual(patch.diff(new, new), [])
+        self.assertEqual(patch.apply(new, patch.diff(new, old)), old)
+
+    def test_snapshot_versions(self):
+        store = SnapshotStore(1)
+        self.assertEqual(store.update('room', 1, {'state': 'intro'}), (None, None))
+        self.assertEqual(store.update('room', 1, {'state': 'intro'}), (None, None))
+        self.assertEqual(store.update('room', 3, {'state': 'round'}), (
+            1, [{'op': 'replace', 'path': '/state', 'value': 'round'}]
+        ))
+        # a late snapshot from another worker neither patches nor replaces the newer one
+        self.assertEqual(store.update('room', 2, {'state': 'intro'}), (None, None))
+        self.assertEqual(store.update('room', 4, {'state': 'round'}), (3, []))
+        store.update('other', 1, {'state': 'intro'})
+        self.assertEqual(store.update('room', 5, {'state': 'questions'}), (None, None))
+
+
+@override_settings(GAMES_ENGINE_ENABLED=True)
+class GameEngineTestCase(TestCase):
+
+    def setUp(self):
+        self.engine = game_engine
+        patcher = mock.patch.object(self.engine, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.engine.evict, -1)
+        self.game = Game.new()
+        for name in ('1', '2', '3'):
+            Player.objects.create(game=self.game, name=name)
+
+    def test_write_behind(self):
+        room_name = f'weakest_{self.game.token}'
+        loader = lambda: Game.objects.get(pk=self.game.pk)
+        with self.engine.use(room_name, loader) as game:
+            with self.assertNumQueries(1):
+                game.next_state(Game.STATE_WAITING_FOR_PLAYERS)
+        self.assertEqual(self.engine.get(room_name, loader).state, Game.STATE_INTRO)
+        self.assertEqual(Game.objects.get(pk=self.game.pk).state, Game.STATE_WAITING_FOR_PLAYERS)
+
+        with self.assertRaises(NothingToDoException):
+            with self.engine.use(room_name, loader) as game:
+                game.state = Game.STATE_END
+                raise NothingToDoException()
+        self.assertEqual(self.engine.get(room_name, loader).state, Game.STATE_INTRO)
+
+        self.engine.flush()
+        self.assertEqual(Game.objects.get(pk=self.game.pk).state, Game.STATE_INTRO)
+
+        self.engine.evict(-1)
+        self.assertNotIn(room_name, self.engine.games)
+        self.assertIsNot(self.engine.get(room_name, loader), game)
+
+    def test_reaped_game(self):
+        room_name = f'weakest_{self.game.token}'
+        loader = lambda: Game.objects.get(pk=self.game.pk)
+        for write in (self.engine.flush, lambda: self.engine.evict(-1)):
+            with self.engine.use(room_name, loader) as game:
+                game.state = Game.STATE_INTRO
+                game.save()
+            Game.objects.filter(pk=self.game.pk).delete()
+            write()
+            self.assertFalse(Game.objects.filter(pk=self.game.pk).exists())
+            self.assertNotIn(room_name, self.engine.games)
+            self.game.save(force_insert=True)
+
+    def test_crash_recovery(self):
+        # the game row is written with the children of the transition that bumps its version
+        room_name = f'weakest_{self.game.token}'
+        loader = lambda: Game.objects.get(pk=self.game.pk)
+        with self.engine.use(room_name, loader) as game, transaction.atomic():
+            Player.objects.create(game=game, name='4')
+            game.next_state(Game.STATE_WAITING_FOR_PLAYERS)
+            self.assertEqual(game.bump_version(), 1)
+        self.engine.discard(room_name)
+        game = self.engine.get(room_name, loader)
+        self.assertEqual((game.state, game.version), (Game.STATE_INTRO, 1))
+        self.assertEqual(game.players.count(), 4)
+
+    def test_stale_game(self):
+        room_name = f'weakest_{self.game.token}'
+        loader = lambda: Game.objects.get(pk=self.game.pk)
+        cached = self.engine.get(room_name, loader)
+        # another worker served the room meanwhile
+        Game.objects.filter(pk=self.game.pk).update(state=Game.STATE_END, version=1)
+        game = self.engine.get(room_name, loader)
+        self.assertIsNot(game, cached)
+        self.assertEqual(game.state, Game.STATE_END)
+
+        # and writes between the check and the transition's update are not overwritten
+        with self.assertRaises(BadStateException):
+            with self.engine.use(room_name, loader) as game, transaction.atomic():
+                Game.objects.filter(pk=self.game.pk).update(version=2)
+                game.state = Game.STATE_INTRO
+                game.save()
+                game.bump_version()
+        self.assertEqual(Game.objects.get(pk=self.game.pk).state, Game.STATE_END)
+        self.assertNotIn(room_name, self.engine.games)
+
+
+class BulkLoaderTestCase(TestCase):
+
+    def load(self, game):
+        loader = BulkLoader()
+        for i in range(3):
+            question = loader.add(feud.models.Question(game=game, text=str(i), is_final=False))
+            for j in range(i + 1):
+                loader.add(feud.models.Answer(question=question, text=f'{i}.{j}', value=j))
+        loader.save()
+        return game
+
+    def assertLoaded(self, game):
+        questions = game.questions.order_by('pk')
+        self.assertEqual([question.text for question in questions], ['0', '1', '2'])
+        self.assertEqual([
+            [answer.text for answer in question.answers.order_by('pk')] for question in questions
+        ], [['0.0'], ['1.0', '1.1'], ['2.0', '2.1', '2.2']])
+
+    def test_load(self):
+        game = feud.models.Game.new()
+        with self.assertNumQueries(2):
+            self.load(game)
+        self.assertLoaded(game)
+
+    def test_load_without_returned_ids(self):
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            game = self.load(feud.models.Game.new())
+        self.assertLoaded(game)
+
+
+class PackCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        cache_settings = override_settings(MEDIA_ROOT_PACKS=os.path.join(root, 'packs'), GAMES_PACK_CACHE_SIZE=250)
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        self.media_dir = os.path.join(root, 'media')
+        os.makedirs(self.media_dir)
+        with open(os.path.join(self.media_dir, 'image.png'), 'wb') as file:
+            file.write(b'0' * 100)
+
+    def test_lru_eviction(self):
+        cache = PackCache()
+        with mock.patch.object(PackCache, 'get_size', wraps=PackCache.get_size) as get_size:
+            for digest in ('a', 'b'):
+                cache.put('jeopardy', digest, [], self.media_dir)
+            self.assertEqual(cache.get('jeopardy', 'a'), [])
+            cache.put('jeopardy', 'c', [], self.media_dir)
+            # only new entries are measured, the least recently used one is gone
+            self.assertEqual(get_size.call_count, 3)
+        self.assertIsNone(cache.get('jeopardy', 'b'))
+        self.assertEqual(cache.get('jeopardy', 'a'), [])
+        self.assertEqual(cache.get('jeopardy', 'c'), [])
+
+        with mock.patch('common.packs.PACK_FORMAT', 2):
+            self.assertIsNone(cache.get('jeopardy', 'c'))
+
+        # another process starts from the tree, ordered by last use
+        cache = PackCache()
+        cache.put('jeopardy', 'd', [], self.media_dir)
+        self.assertIsNone(cache.get('jeopardy', 'a'))
+        self.assertEqual(cache.get('jeopardy', 'c'), [])
+
+
+class ReaperTestCase(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = override_settings(**{
+            name: os.path.join(media_root, name) for name in (
+                'MEDIA_ROOT_WHIRLIGIG', 'MEDIA_ROOT_JEOPARDY', 'MEDIA_ROOT_WEAKEST', 'MEDIA_ROOT_FEUD',
+                'MEDIA_ROOT_BLOBS', 'MEDIA_ROOT_RENDITIONS',
+            )
+        })
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def test_reap(self):
+        expired = timezone.now() - datetime.timedelta(minutes=1)
+        games = []
+        for model in (jeopardy.models.Game, whirligig.models.Game, Game, feud.models.Game):
+            for _ in range(3):
+                game = model.new()
+                model.objects.filter(pk=game.pk).update(expired=expired)
+                games.append(game)
+        Player.objects.create(game=games[6], name='A')
+        alive = Game.new()
+        for game in games[:3]:
+            os.makedirs(os.path.join(settings.MEDIA_ROOT_JEOPARDY, game.token))
+            with open(os.path.join(settings.MEDIA_ROOT_JEOPARDY, game.token, 'image.png'), 'wb') as file:
+                file.write(b'12345')
+
+        before = metrics.get().get('reaper_games', 0)
+        total = reaper.reap(batch_size=2)
+
+        self.assertEqual(total['games'], 12)
+        self.assertEqual(total['rows'], 13)
+        self.assertEqual(total['bytes'], 15)
+        self.assertEqual(metrics.get()['reaper_games'], before + 12)
+        self.assertFalse(os.listdir(settings.MEDIA_ROOT_JEOPARDY))
+        for model in (jeopardy.models.Game, whirligig.models.Game, feud.models.Game):
+            self.assertFalse(model.objects.exists())
+        self.assertEqual(list(Game.objects.all()), [alive])
+
+
+class ButtonArbiterTestCase(SimpleTestCase):
+
+    def test_first_press_wins(self):
+        arbiter = ButtonArbiter(0)
+        self.assertIsNone(arbiter.press('room', 'a'))
+
+        arbiter.setdefault('room', False)
+        self.assertFalse(arbiter.press('room', 'a'))
+
+        arbiter.reset('room', True)
+        arbiter.setdefault('room', False)
+        press = arbiter.press('room', 'b', 20)
+        self.assertTrue(arbiter.decide('room', press))
+        self.assertFalse(arbiter.press('room', 'a', 21))
+        self.assertEqual(arbiter.get_presses('room'), [(20, 20, 'b')])
+
+        arbiter.reset('room', True)
+        self.assertTrue(arbiter.decide('room', arbiter.press('room', 'a')))
+
+    def test_compensated_press_wins(self):
+        arbiter = ButtonArbiter(50 / 1e9)
+        arbiter.open('room')
+        first = arbiter.press('room', 'a', 1000)
+        second = arbiter.press('room', 'b', 1030, 990)
+        third = arbiter.press('room', 'c', 1040, 900)
+        self.assertFalse(arbiter.press('room', 'd', 1051, 900))
+
+        self.assertEqual(third.pressed_at, 990)
+        self.assertFalse(arbiter.decide('room', first))
+        self.assertTrue(arbiter.decide('room', second))
+        self.assertFalse(arbiter.decide('room', third))
+
+
+class TimerWheelTestCase(SimpleTestCase):
+
+    async def test_fire_in_order(self):
+        wheel = TimerWheel(0.01, 8)
+        wheel.bind(asyncio.get_running_loop())
+        fired = []
+
+        def callback(name):
+            async def fire():
+                fired.append(name)
+            return fire
+
+        wheel.schedule('a', 0.15, callback('a'))
+        wheel.schedule('b', 0.03, callback('b'))
+        wheel.schedule('c', 0.05, callback('c'))
+        wheel.schedule('c', 0.1, callback('c2'))
+        wheel.schedule('d', 0.02, callback('d'))
+        wheel.cancel('d')
+        await asyncio.sleep(0.3)
+
+        self.assertEqual(fired, ['b', 'c2', 'a'])
+        self.assertIsNone(wheel.handle)
+        self.assertFalse(any(wheel.slots))
+
+
+class UnzipTestCase(SimpleTestCase):
+
+    class Stream(io.RawIOBase):
+        def __init__(self, data):
+            self.data = io.BytesIO(data)
+
+        def readable(self):
+            return True
+
+        def readinto(self, buffer):
+            return self.data.readinto(buffer)
+
+    def test_unzip_non_seekable_stream(self):
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w') as archive:
+            archive.writestr('content.xml', '<package/>')
+            archive.writestr('Images/%D0%B0.png', b'image')
+
+        extract_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, extract_dir)
+        unzip(self.Stream(data.getvalue()), extract_dir)
+
+        with open(os.path.join(extract_dir, 'content.xml')) as file:
+            self.assertEqual(file.read(), '<package/>')
+        with open(os.path.join(extract_dir, 'Images', 'а.png'), 'rb') as file:
+            self.assertEqual(file.read(), b'image')
+
+    def test_unzip_deduplicates_media(self):
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w') as archive:
+            archive.writestr('Images/1.png', b'image')
+            archive.writestr('Images/2.png', b'image')
+            archive.writestr('Audio/1.mp3', b'audio')
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        blobs_dir = os.path.join(media_root, 'blobs')
+        first, second = os.path.join(media_root, 'first'), os.path.join(media_root, 'second')
+        unzip(data, first, blobs_dir=blobs_dir)
+        unzip(data, second, blobs_dir=blobs_dir)
+
+        image = os.stat(os.path.join(first, 'Images', '1.png'))
+        self.assertEqual(image.st_nlink, 5)
+        self.assertEqual(image.st_ino, os.stat(os.path.join(second, 'Images', '2.png')).st_ino)
+        self.assertEqual(sorted(os.listdir(os.path.join(first, 'Images'))), ['1.png', '2.png'])
+
+        shutil.rmtree(first)
+        self.assertEqual(clean_blobs(blobs_dir), (0, 0))
+        shutil.rmtree(second)
+        self.assertEqual(clean_blobs(blobs_dir), (2, 10))
+        self.assertEqual(os.listdir(blobs_dir), [])
+
+
+class MediaTestCase(SimpleTestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = override_settings(MEDIA_ROOT=media_root, **{
+            name: os.path.join(media_root, directory) for name, directory in (
+                ('MEDIA_ROOT_PACKS', 'packs'), ('MEDIA_ROOT_BLOBS', 'blobs'), ('MEDIA_ROOT_RENDITIONS', 'renditions'),
+            )
+        })
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        os.makedirs(os.path.join(media_root, 'jeopardy', 'Video'))
+        with open(os.path.join(media_root, 'jeopardy', 'Video', 'clip.mp4'), 'wb') as file:
+            file.write(bytes(range(256)) * 10)
+        os.makedirs(os.path.join(media_root, 'blobs', 'ab'))
+        with open(os.path.join(media_root, 'blobs', 'ab', 'abcdef'), 'w') as file:
+            file.write('<package/>')
+
+    def get(self, path, headers=(), method='GET'):
+        communicator = HttpCommunicator(MediaApplication(), method, path, headers=[
+            (name.encode(), value.encode()) for name, value in headers
+        ])
+        response = asyncio.run(communicator.get_response())
+        response['headers'] = {name.decode().lower(): value.decode() for name, value in response['headers']}
+        return response
+
+    def test_full(self):
+        response = self.get('/media/jeopardy/Video/clip.mp4')
+        self.assertEqual(response['status'], 200)
+        self.assertEqual(response['body'], bytes(range(256)) * 10)
+        self.assertEqual(response['headers']['content-type'], 'video/mp4')
+        self.assertEqual(response['headers']['accept-ranges'], 'bytes')
+        self.assertIn('max-age', response['headers']['cache-control'])
+
+        head = self.get('/media/jeopardy/Video/clip.mp4', method='HEAD')
+        self.assertEqual(head['body'], b'')
+        self.assertEqual(head['headers']['content-length'], '2560')
+
+    def test_range(self):
+        response = self.get('/media/jeopardy/Video/clip.mp4', [('Range', 'bytes=10-19')])
+        self.assertEqual(response['status'], 206)
+        self.assertEqual(response['body'], bytes(range(10, 20)))
+        self.assertEqual(response['headers']['content-range'], 'bytes 10-19/2560')
+
+        response = self.get('/media/jeopardy/Video/clip.mp4', [('Range', 'bytes=-6')])
+        self.assertEqual(response['body'], bytes(range(250, 256)))
+
+        response = self.get('/media/jeopardy/Video/clip.mp4', [('Range', 'bytes=3000-')])
+        self.assertEqual(response['status'], 416)
+        self.assertEqual(response['headers']['content-range'], 'bytes */2560')
+
+        response = self.get('/media/jeopardy/Video/clip.mp4', [('Range', 'bytes=0-9'), ('If-Range', '"stale"')])
+        self.assertEqual(response['status'], 200)
+
+    def test_conditional(self):
+        etag = self.get('/media/jeopardy/Video/clip.mp4')['headers']['etag']
+        response = self.get('/media/jeopardy/Video/clip.mp4', [('If-None-Match', etag)])
+        self.assertEqual(response['status'], 304)
+        self.assertEqual(response['body'], b'')
+
+    def test_not_found(self):
+        with open(os.path.join(settings.MEDIA_ROOT, 'secret'), 'w'):
+            pass
+        os.makedirs(settings.MEDIA_ROOT_PACKS)
+        with open(os.path.join(settings.MEDIA_ROOT_PACKS, 'pack.json'), 'w'):
+            pass
+        self.assertEqual(self.get('/media/jeopardy/Video/missing.mp4')['status'], 404)
+        self.assertEqual(self.get('/media/jeopardy/../../secret')['status'], 404)
+        self.assertEqual(self.get('/media/jeopardy/Video/1.mp4\x00.png')['status'], 404)
+        self.assertEqual(self.get('/media/packs/pack.json')['status'], 404)
+        self.assertEqual(self.get('/media/blobs/ab/abcdef')['status'], 404)
+        self.assertEqual(self.get('/media/jeopardy/Video')['status'], 404)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT='/protected/')
+    def test_accel_redirect(self):
+        response = self.get('/media/jeopardy/Video/clip.mp4')
+        self.assertEqual(response['headers']['x-accel-redirect'], '/protected/jeopardy/Video/clip.mp4')
+        self.assertEqual(response['body'], b'')
+
+
+class RouterTestCase(SimpleTestCase):
+
+    def test_ring_moves_only_dead_node_rooms(self):
+        ring = HashRing(['a', 'b', 'c'])
+        rooms = [f'jeopardy_{i}' for i in range(1000)]
+        owners = {room: ring.get(room) for room in rooms}
+        self.assertEqual(set(owners.values()), {'a', 'b', 'c'})
+
+        ring.remove('b')
+        for room in rooms:
+            if owners[room] != 'b':
+                self.assertEqual(ring.get(room), owners[room])
+            else:
+                self.assertIn(ring.get(room), ('a', 'c'))
+
+        ring.add('b')
+        self.assertEqual({room: ring.get(room) for room in rooms}, owners)
+
+    def test_room_name(self):
+        self.assertEqual(get_room_name('/jeopardy/ws/abc123', {}), 'jeopardy_ABC123')
+        self.assertEqual(get_room_name('/feud/v1/teams/register', {'content-type': 'application/json'},
+                                       b'{"token": "abc", "name": "x"}'), 'feud_ABC')
+        self.assertEqual(get_room_name('/weakest/v1/players/register',
+                                       {'content-type': 'application/x-www-form-urlencoded'},
+                                       b'token=abc&name=x'), 'weakest_ABC')
+        self.assertEqual(get_room_name('/weakest/v1/players/register',
+                                       {'content-type': 'multipart/form-data; boundary=x'},
+                                       b'--x\r\nContent-Disposition: form-data; name="token"\r\n\r\nabc\r\n--x--'),
+                         'weakest_ABC')
+        self.assertIsNone(get_room_name('/jeopardy/v1/create', {}))
+
+    def test_sticky_rooms(self):
+        router = RoomRouter(['a', 'b'], drain_time=60)
+        owner = router.pick('room')
+        other = 'b' if owner == 'a' else 'a'
+        router.mark_dead(owner)
+        assignment = router.acquire('room', router.pick('room'))
+        self.assertEqual(assignment.backend, other)
+
+        # the owner is back, the room stays where its connections are until it drained
+        router.mark_alive(owner)
+        self.assertEqual(router.pick('room'), other)
+        router.release(assignment)
+        self.assertEqual(router.pick('room'), other)
+        router.drain_time = 0
+        router.clean()
+        self.assertEqual(router.pick('room'), owner)
+        self.assertEqual(router.rooms, {})
+
+    def test_routing(self):
+        async def run():
+            async def backend(name, reader, writer):
+                await reader.readuntil(b'\r\n\r\n')
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\n' + name.encode())
+                await writer.drain()
+                writer.close()
+
+            servers = {}
+            for name in ('a', 'b'):
+                servers[name] = await asyncio.start_server(lambda r, w, name=name: backend(name, r, w), '127.0.0.1', 0)
+            addresses = {name: '127.0.0.1:%d' % server.sockets[0].getsockname()[1]
+                         for name, server in servers.items()}
+            router = RoomRouter(addresses.values())
+            front = await asyncio.start_server(router.handle, '127.0.0.1', 0)
+            port = front.sockets[0].getsockname()[1]
+
+            async def request(path):
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(f'GET {path} HTTP/1.1\r\nHost: test\r\n\r\n'.encode())
+                response = await reader.read()
+                writer.close()
+                return response[-1:].decode()
+
+            owner = await request('/jeopardy/ws/TOKEN')
+            self.assertEqual(await request('/jeopardy/ws/TOKEN'), owner)
+
+            servers[owner].close()
+            await servers[owner].wait_closed()
+            other = 'b' if owner == 'a' else 'a'
+            self.assertEqual(await request('/jeopardy/ws/TOKEN'), other)
+            self.assertNotIn(addresses[owner], router.alive)
+
+            front.close()
+            servers[other].close()
+
+        asyncio.run(run())
+
+    def test_router_needs_broker(self):
+        # workers with their own in-memory layers would not see the broadcasts of each other
+        with self.assertRaises(CommandError):
+            call_command('runrouter', backend=['127.0.0.1:1'])
+
+
+class BrokerChannelLayerTestCase(SimpleTestCase):
+
+    async def start_broker(self):
+        address = 'unix:' + os.path.join(tempfile.mkdtemp(), 'broker.sock')
+        self.broker = Broker(capacity=2, expiry=60)
+        started = asyncio.Event()
+        self.server = asyncio.ensure_future(self.broker.serve(address, started))
+        await started.wait()
+        self.layer = BrokerChannelLayer(address=address)
+
+    async def stop_broker(self):
+        await self.layer.close()
+        self.server.cancel()
+
+    async def test_send_receive(self):
+        await self.start_broker()
+        try:
+            channel = await self.layer.new_channel()
+            await self.layer.send(channel, {'type': 'game', 'frame': b'\x00'})
+            await self.layer.send(channel, {'type': 'game', 'frame': '1'})
+            with self.assertRaises(ChannelFull):
+                await self.layer.send(channel, {'type': 'game', 'frame': '2'})
+            self.assertEqual(await self.layer.receive(channel), {'type': 'game', 'frame': b'\x00'})
+            self.assertEqual(await self.layer.receive(channel), {'type': 'game', 'frame': '1'})
+
+            waiter = asyncio.ensure_future(self.layer.receive(channel))
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            await asyncio.sleep(0.01)
+            self.assertFalse(self.broker.waiters)
+        finally:
+            await self.stop_broker()
+
+    async def test_group_send(self):
+        await self.start_broker()
+        try:
+            channels = [await self.layer.new_channel() for _ in range(3)]
+            for channel in channels:
+                await self.layer.group_add('room', channel)
+            await self.layer.group_discard('room', channels[2])
+
+            receivers = [asyncio.ensure_future(self.layer.receive(channel)) for channel in channels[:2]]
+            await self.layer.group_send('room', {'type': 'intercom', 'frame': 'skip'})
+            self.assertEqual(await asyncio.gather(*receivers), [{'type': 'intercom', 'frame': 'skip'}] * 2)
+
+            self.broker.expiry = -1
+            await self.layer.group_send('room', {'type': 'intercom', 'frame': 'skip'})
+            await self.layer.receive(channels[0])
+            self.broker.clean_expired()
+            self.assertEqual(list(self.broker.groups['room']), [channels[0]])
+        finally:
+            await self.stop_broker()
+
+    async def test_off_loop_connections(self):
+        await self.start_broker()
+        try:
+            channel = await self.layer.new_channel()
+            await self.layer.group_add('room', channel)
+            group_send = async_to_sync(self.layer.group_send)
+            for _ in range(3):
+                await asyncio.get_running_loop().run_in_executor(None, group_send, 'room', {'type': 'intercom'})
+                self.assertEqual(await self.layer.receive(channel), {'type': 'intercom'})
+            # the connections of the loops async_to_sync ran are closed with them
+            self.assertEqual(list(self.layer.connections), [asyncio.get_running_loop()])
+        finally:
+            await self.stop_broker()
+
+
+class ConsumerTestCase(TransactionTestCase):
+
+    async def test_bad_token(self):
+        communicator = WebsocketCommunicator(application, 'weakest/ws/UNKNOWN')
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+    async def test_next_state_broadcast(self):
+        game = await self.create_game()
+
+        host = WebsocketCommunicator(application, f'weakest/ws/{game.token}')
+        screen = WebsocketCommunicator(application, f'weakest/ws/{game.token}')
+        for communicator in (host, screen):
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            message = await communicator.receive_json_from()
+            self.assertEqual(message['type'], 'game')
+            self.assertEqual(message['message']['state'], Game.STATE_WAITING_FOR_PLAYERS)
+
+        await host.send_json_to({'method': 'next_state', 'params': {'from_state': Game.STATE_WAITING_FOR_PLAYERS}})
+        for communicator in (host, screen):
+            message = await communicator.receive_json_from()
+            self.assertEqual(message['type'], 'game')
+            self.assertEqual(message['message']['state'], Game.STATE_INTRO)
+
+        await host.send_json_to({'method': 'select_weakest', 'params': {'player_id': 0, 'weakest_id': 0}})
+        self.assertTrue(await screen.receive_nothing())
+        await host.send_json_to({'method': 'unknown', 'params': {}})
+        message = await host.receive_json_from()
+        self.assertEqual(message['type'], 'error')
+
+        await host.send_json_to({'method': 'intercom', 'message': 'sound'})
+        message = await screen.receive_json_from()
+        self.assertEqual(message, {'type': 'intercom', 'message': 'sound'})
+
+        await host.disconnect()
+        await screen.disconnect()
+
+    async def test_patches(self):
+        game = await self.create_game()
+
+        host = WebsocketCommunicator(application, f'weakest/ws/{game.token}')
+        screen = WebsocketCommunicator(application, f'weakest/ws/{game.token}?patch=1')
+        await host.connect()
+        await screen.connect()
+        await host.receive_json_from()
+        snapshot = await screen.receive_json_from()
+        self.assertEqual(snapshot['type'], 'game')
+
+        await host.send_json_to({'method': 'next_state', 'params': {'from_state': Game.STATE_WAITING_FOR_PLAYERS}})
+        message = await host.receive_json_from()
+        self.assertEqual(message['type'], 'game')
+        self.assertEqual(message['version'], snapshot['version'] + 1)
+        message = await screen.receive_json_from()
+        self.assertEqual(message['type'], 'game_patch')
+        self.assertEqual(message['message']['base'], snapshot['version'])
+        self.assertEqual(patch.apply(snapshot['message'], message['message']['patch'])['state'], Game.STATE_INTRO)
+
+        await screen.send_json_to({'method': 'snapshot'})
+        message = await screen.receive_json_from()
+        self.assertEqual(message['type'], 'game')
+        self.assertEqual(message['message']['state'], Game.STATE_INTRO)
+
+        await host.disconnect()
+        await screen.disconnect()
+
+    async def test_snapshot_from_other_worker(self):
+        game = await self.create_game()
+
+        screen = WebsocketCommunicator(application, f'weakest/ws/{game.token}?patch=1')
+        await screen.connect()
+        snapshot = await screen.receive_json_from()
+
+        # a worker that never saw the room broadcasts after a registration
+        def register():
+            player = Player.objects.create(game=game, name='4')
+            snapshots.snapshots.clear()
+            group_send_sync(f'weakest_{game.token}', 'game', {'players': [player.name]}, game.bump_version())
+        await database_sync_to_async(register)()
+        message = await screen.receive_json_from()
+        self.assertEqual(message['type'], 'game')
+        self.assertEqual(message['version'], snapshot['version'] + 1)
+        self.assertEqual(message['message'], {'players': ['4']})
+
+        await screen.disconnect()
+
+    async def test_timer_expiry(self):
+        game = await self.create_game()
+        game.state = Game.STATE_QUESTIONS
+        game.timer = int((time.time() + 0.2) * 1000)
+        await database_sync_to_async(game.save)()
+
+        host = WebsocketCommunicator(application, f'weakest/ws/{game.token}')
+        await host.connect()
+        message = await host.receive_json_from()
+        self.assertEqual(message['message']['state'], Game.STATE_QUESTIONS)
+        message = await host.receive_json_from(timeout=2)
+        self.assertEqual(message['message']['state'], Game.STATE_WEAKEST_CHOOSE)
+        await host.disconnect()
+
+    async def test_clock_sync(self):
+        game = await self.create_game()
+        client = WebsocketCommunicator(application, f'weakest/ws/{game.token}')
+        await client.connect()
+        await client.receive_json_from()
+
+        samples = []
+        for _ in range(3):
+            t0 = time.time() * 1000 - 5000
+            await client.send_json_to({'method': 'ping', 'params': {'t0': t0}})
+            pong = (await client.receive_json_from())['message']
+            self.assertEqual(pong['t0'], t0)
+            samples.append([t0, pong['t1'], pong['t2'], time.time() * 1000 - 5000])
+        await client.send_json_to({'method': 'clock_report', 'params': {'samples': samples}})
+        message = await client.receive_json_from()
+        self.assertEqual(message['type'], 'clock')
+        self.assertAlmostEqual(message['message']['offset'], 5000, delta=50)
+        self.assertGreaterEqual(message['message']['rtt'], 0)
+        await client.disconnect()
+
+    async def test_binary_wire_format(self):
+        game = await self.create_game()
+        for wire_format, kwargs in (
+            ('msgpack', dict(path=f'weakest/ws/{game.token}?format=msgpack')),
+            ('cbor', dict(path=f'weakest/ws/{game.token}', subprotocols=['bunjgames.cbor'])),
+        ):
+            decode = WIRE_FORMATS[wire_format].decode
+            client = WebsocketCommunicator(application, **kwargs)
+            connected, subprotocol = await client.connect()
+            self.assertTrue(connected)
+            self.assertEqual(subprotocol, kwargs.get('subprotocols', [None])[0])
+            message = decode(await client.receive_from())
+            self.assertEqual(message['type'], 'game')
+            self.assertEqual(message['message']['state'], Game.STATE_WAITING_FOR_PLAYERS)
+
+            await client.send_to(bytes_data=WIRE_FORMATS[wire_format].encode({'method': 'ping', 'params': {'t0': 1}}))
+            self.assertEqual(decode(await client.receive_from())['type'], 'pong')
+            await client.disconnect()
+
+    @override_settings(GAMES_OUTBOX_LIMIT=3)
+    async def test_outbox(self):
+        consumer = WeakestConsumer()
+        consumer.room_name = 'weakest_TEST'
+        consumer.outbox, consumer.outbox_ready = deque(), asyncio.Event()
+        consumer.sender = mock.Mock()
+        consumer.close = mock.AsyncMock()
+
+        game = lambda version: {'type': 'game', 'version': version, 'frame': str(version)}
+        for event in (game(1), game(2), make_event('intercom', 'a'), game(3), game(5), game(4)):
+            consumer.push(event)
+        self.assertEqual(
+            [event['frame'] for event, _ in consumer.outbox], ['2', make_event('intercom', 'a')['frame'], '5']
+        )
+
+        consumer.push(make_event('intercom', 'b'))
+        await asyncio.sleep(0)
+        self.assertIsNone(consumer.outbox)
+        consumer.close.assert_called_once_with(code=4008)
+
+    @override_settings(GAMES_OUTBOX_LIMIT=3, GAMES_ACK_WINDOW=1)
+    async def test_stalled_receiver(self):
+        game = await self.create_game()
+        room_name = f'weakest_{game.token}'
+        host = WebsocketCommunicator(application, f'weakest/ws/{game.token}')
+        screen = WebsocketCommunicator(application, f'weakest/ws/{game.token}?ack=1')
+        for communicator in (host, screen):
+            await communicator.connect()
+            self.assertEqual((await communicator.receive_json_from())['version'], 0)
+
+        async def broadcast(*events):
+            await broadcast_scheduler.send(room_name, list(events))
+
+        # the screen has not acked its snapshot yet, newer ones wait for it and replace each other
+        for version in (1, 2, 3):
+            await broadcast(make_game_event(room_name, {'state': str(version)}, version))
+            self.assertEqual((await host.receive_json_from())['version'], version)
+        self.assertTrue(await screen.receive_nothing())
+        await screen.send_json_to({'method': 'ack', 'params': {'version': 0}})
+        self.assertEqual((await screen.receive_json_from())['message'], {'state': '3'})
+        self.assertTrue(await screen.receive_nothing())
+
+        # the host is not held back, the screen is dropped once its outbox is full
+        await broadcast(make_game_event(room_name, {'state': '4'}, 4))
+        for message in ('a', 'b', 'c'):
+            await broadcast(make_event('intercom', message))
+        self.assertEqual((await host.receive_json_from())['version'], 4)
+        self.assertEqual([(await host.receive_json_from())['message'] for _ in range(3)], ['a', 'b', 'c'])
+        self.assertEqual(await screen.receive_output(), {'type': 'websocket.close', 'code': 4008})
+        await host.disconnect()
+
+    async def test_send_failure(self):
+        game = await self.create_game()
+        communicator = WebsocketCommunicator(application, f'weakest/ws/{game.token}')
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        with mock.patch.object(WeakestConsumer, 'send_frame', side_effect=ConnectionError('reset')), \
+                self.assertLogs('common.consumers', 'WARNING'):
+            await communicator.send_json_to({'method': 'intercom', 'message': 'sound'})
+            self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': 1011})
+
+    async def test_transition_batch(self):
+        game = await database_sync_to_async(self.create_feud_game)()
+        host = WebsocketCommunicator(application, f'feud/ws/{game.token}?batch=1')
+        screen = WebsocketCommunicator(application, f'feud/ws/{game.token}')
+        for communicator in (host, screen):
+            await communicator.connect()
+            await communicator.receive_json_from()
+
+        await host.send_json_to({'method': 'answer', 'params': {'is_correct': False, 'answer_id': None}})
+        message = await host.receive_json_from()
+        self.assertEqual(message['type'], 'batch')
+        self.assertEqual([item['type'] for item in message['message']], ['intercom', 'game'])
+        self.assertEqual(message['message'][0]['message'], 'wrong')
+        # clients that did not ask for batches get the frames one by one
+        self.assertEqual([(await screen.receive_json_from())['type'] for _ in range(2)], ['intercom', 'game'])
+        for communicator in (host, screen):
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+
+    async def test_broadcast_window(self):
+        game = await self.create_game()
+        room_name = f'weakest_{game.token}'
+        host = WebsocketCommunicator(application, f'weakest/ws/{game.token}')
+        await host.connect()
+        await host.receive_json_from()
+        with mock.patch.object(broadcast_scheduler, 'window', 0.05):
+            await broadcast_scheduler.send(room_name, [make_event('intercom', 'sound')])
+            await broadcast_scheduler.send(room_name, [make_event('intercom', 'gong')])
+        # senders return at once, the loop flushes the window
+        self.assertEqual([(await host.receive_json_from())['message'] for _ in range(2)], ['sound', 'gong'])
+        await host.disconnect()
+
+    @staticmethod
+    def create_feud_game():
+        game = feud.models.Game.new()
+        teams = [feud.models.Team.objects.create(game=game, name=name) for name in ('1', '2')]
+        game.question = feud.models.Question.objects.create(game=game, text='q', is_final=False)
+        game.state, game.answerer = feud.models.Game.STATE_BUTTON, teams[0]
+        game.save()
+        return game
+
+    @staticmethod
+    @database_sync_to_async
+    def create_game():
+        game = Game.new()
+        for name in ('1', '2', '3'):
+            Player.objects.create(game=game, name=name)
+        return game
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import math
+from collections import namedtuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+Timer = namedtuple('Timer', ['tick', 'callback'])
+
+
+class TimerWheel:
+    # hashed timing wheel on the event loop, one timer per key. Scheduling and cancelling are O(1),
+    # a tick only visits its own slot and the wheel stops ticking while it is empty
+    def __init__(self, tick, size):
+        self.tick = tick
+        self.size = size
+        self.loop = None
+        self.reset()
+
+    def reset(self):
+        self.slots = [{} for _ in range(self.size)]
+        self.timers = {}
+        self.current = 0
+        self.base = 0
+        self.handle = None
+
+    def bind(self, loop):
+        if self.loop is not loop:
+            if self.handle is not None:
+                self.handle.cancel()
+            self.loop = loop
+            self.reset()
+
+    def call(self, func, *args):
+        # the wheel is only touched on its loop, sync code hands the call over
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None and running is self.loop:
+            func(*args)
+        elif self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def schedule(self, key, delay, callback):
+        self.call(self.add, key, delay, callback)
+
+    def cancel(self, key):
+        self.call(self.remove, key)
+
+    def add(self, key, delay, callback):
+        self.remove(key)
+        now = self.loop.time()
+        if self.handle is None:
+            # idle wheel, restart the clock at the current tick
+            self.base = now - self.current * self.tick
+            self.handle = self.loop.call_at(self.base + (self.current + 1) * self.tick, self.run)
+        tick = max(self.current + 1, math.ceil((now + delay - self.base) / self.tick))
+        timer = Timer(tick, callback)
+        self.timers[key] = timer
+        self.slots[tick % self.size][key] = timer
+
+    def remove(self, key):
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            del self.slots[timer.tick % self.size][key]
+
+    def run(self):
+        # a late loop catches up, visiting every slot at most once
+        current = max(self.current + 1, int((self.loop.time() - self.base) / self.tick))
+        for tick in range(self.current + 1, min(current, self.current + self.size) + 1):
+            slot = self.slots[tick % self.size]
+            for key in [key for key, timer in slot.items() if timer.tick <= current]:
+                timer = slot.pop(key)
+                del self.timers[key]
+                self.loop.create_task(self.fire(key, timer.callback))
+        self.current = current
+        if self.timers:
+            self.handle = self.loop.call_at(self.base + (self.current + 1) * self.tick, self.run)
+        else:
+            self.handle = None
+
+    @staticmethod
+    async def fire(key, callback):
+        try:
+            await callback()
+        except Exception as e:
+            logger.error('Timer %s failed: %s' % (key, str(e)))
+
+
+timer_wheel = TimerWheel(settings.GAMES_TIMER_TICK, settings.GAMES_TIMER_SLOTS)
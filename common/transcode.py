@@ -0,0 +1,180 @@
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import threading
+import uuid
+import wave
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+from common.utils import get_blob_path, get_file_digest
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.bmp', '.gif', '.jpeg', '.jpg', '.png', '.tif', '.tiff', '.webp')
+AUDIO_EXTENSIONS = ('.wav',)
+
+
+def optimize_image(source, target, max_size, max_bytes):
+    with Image.open(source) as image:
+        if getattr(image, 'is_animated', False):
+            return None
+        if max(image.size) <= max_size and os.path.getsize(source) <= max_bytes:
+            return None
+        image.thumbnail((max_size, max_size))
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            target += '.png'
+            image.save(target, 'PNG', optimize=True)
+        else:
+            target += '.jpg'
+            image.convert('RGB').save(target, 'JPEG', quality=85, optimize=True, progressive=True)
+    return target
+
+
+def optimize_wave(source, target, max_rate):
+    # pure python: 16 bit PCM is mixed down to mono and decimated by averaging
+    with wave.open(source, 'rb') as reader:
+        channels, width, rate, frames = \
+            reader.getnchannels(), reader.getsampwidth(), reader.getframerate(), reader.getnframes()
+        if width != 2 or (channels == 1 and rate <= max_rate):
+            return None
+        samples = array('h', reader.readframes(frames))
+    if sys.byteorder == 'big':
+        samples.byteswap()
+
+    factor = max(1, rate // max_rate)
+    group = channels * factor
+    optimized = array('h', (sum(samples[i:i + group]) // group for i in range(0, len(samples) - group + 1, group)))
+    if sys.byteorder == 'big':
+        optimized.byteswap()
+
+    target += '.wav'
+    with wave.open(target, 'wb') as writer:
+        writer.setnchannels(1)
+        writer.setsampwidth(2)
+        writer.setframerate(rate // factor)
+        writer.writeframes(optimized.tobytes())
+    return target
+
+
+def make_rendition(source, renditions_dir, max_image_size, max_image_bytes, max_audio_rate):
+    # runs in a worker process, renditions are shared between games by the digest of the original
+    # and the limits they were made with, changing the limits renders them again
+    digest = get_file_digest(source)
+    path = get_blob_path(renditions_dir, digest) + f'-{max_image_size}-{max_image_bytes}-{max_audio_rate}'
+    for extension in ('.jpg', '.png', '.wav'):
+        if os.path.exists(path + extension):
+            return path + extension
+    if os.path.exists(path + '.none'):
+        return None
+
+    # the temporary file stays out of the store until it is complete
+    temp = f'{source}.{uuid.uuid4().hex}.part'
+    try:
+        if source.lower().endswith(AUDIO_EXTENSIONS):
+            result = optimize_wave(source, temp, max_audio_rate)
+        else:
+            result = optimize_image(source, temp, max_image_size, max_image_bytes)
+        if result is not None and os.path.getsize(result) >= os.path.getsize(source):
+            os.remove(result)
+            result = None
+        if result is None:
+            # remember that the original is good enough
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path + '.none', 'w').close()
+            return None
+        rendition = path + os.path.splitext(result)[1]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(result, rendition)
+        return rendition
+    except Exception:
+        for extension in ('.png', '.jpg', '.wav'):
+            if os.path.exists(temp + extension):
+                os.remove(temp + extension)
+        raise
+
+
+class Transcoder:
+    ATTEMPTS = 3
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                # workers are spawned, forking a threaded server is not safe
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self.executor
+
+    @staticmethod
+    def get_path(directory, url):
+        if not url or '://' in url:
+            return None
+        path = os.path.realpath(os.path.join(directory, *url.strip('/').split('/')))
+        if not path.startswith(os.path.realpath(directory) + os.sep) or not os.path.isfile(path):
+            return None
+        extension = os.path.splitext(path)[1].lower()
+        if extension in AUDIO_EXTENSIONS or (extension in IMAGE_EXTENSIONS and Image is not None):
+            return path
+        return None
+
+    def render(self, path):
+        return self.get_executor().submit(
+            make_rendition, path, settings.MEDIA_ROOT_RENDITIONS, settings.GAMES_MEDIA_MAX_IMAGE_SIZE,
+            settings.GAMES_MEDIA_MAX_IMAGE_BYTES, settings.GAMES_MEDIA_MAX_AUDIO_RATE
+        )
+
+    @staticmethod
+    def link(rendition, target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(rendition, target)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            shutil.copyfile(rendition, target)
+
+    def optimize(self, directory, urls):
+        # returns optimized urls by original, renditions are linked under <directory>/optimized
+        paths = {url: self.get_path(directory, url) for url in dict.fromkeys(urls)}
+        futures = {url: self.render(path) for url, path in paths.items() if path}
+
+        optimized = {}
+        for url, future in futures.items():
+            for attempt in range(self.ATTEMPTS):
+                try:
+                    rendition = future.result()
+                    if rendition is None:
+                        break
+                    optimized_url = ('/' if url.startswith('/') else '') + 'optimized/' + url.strip('/') + \
+                        os.path.splitext(rendition)[1]
+                    self.link(rendition, os.path.join(directory, *optimized_url.strip('/').split('/')))
+                    optimized[url] = optimized_url
+                    break
+                except FileNotFoundError as e:
+                    # clean_blobs removed the rendition before it was linked, it is rendered again
+                    logger.info('Rendition of %s is gone: %s' % (url, str(e)))
+                    future = self.render(paths[url])
+                except Exception as e:
+                    logger.warning('Failed to optimize %s: %s' % (url, str(e)))
+                    break
+        return optimized
+
+
+transcoder = Transcoder(settings.GAMES_MEDIA_WORKERS)
@@ -4,4 +4,6 @@ from common import api
 
 urlpatterns = [
     path('v1/time', api.TimeAPI.as_view()),
+    path('v1/imports/<str:job_id>', api.ImportStatusAPI.as_view()),
+    path('v1/metrics', api.MetricsAPI.as_view()),
 ]
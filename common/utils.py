@@ -1,9 +1,14 @@
+import hashlib
 import os
 import shutil
 import string
+import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from urllib.parse import unquote
 
+from channels.db import database_sync_to_async
 from rest_framework.exceptions import APIException
 from django.conf import settings
 from hashids import Hashids
@@ -21,8 +26,90 @@ class NothingToDoException(APIException):
     status_code = 400
 
 
-def unzip(filename, extract_dir):
-    with zipfile.ZipFile(filename) as archive:
+CHUNK_SIZE = 1024 * 1024
+
+
+@contextmanager
+def seekable(file):
+    if isinstance(file, (str, os.PathLike)):
+        yield file
+        return
+    if file.seekable():
+        file.seek(0)
+        yield file
+        return
+    with tempfile.TemporaryFile() as spooled:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            spooled.write(chunk)
+        spooled.seek(0)
+        yield spooled
+
+
+def get_file_digest(file):
+    digest = hashlib.sha256()
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as source:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+    else:
+        file.seek(0)
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+        file.seek(0)
+    return digest.hexdigest()
+
+
+def link_tree(source_dir, target_dir):
+    for directory, _, files in os.walk(source_dir):
+        target = os.path.join(target_dir, os.path.relpath(directory, source_dir))
+        os.makedirs(target, exist_ok=True)
+        for name in files:
+            try:
+                os.link(os.path.join(directory, name), os.path.join(target, name))
+            except OSError:
+                shutil.copyfile(os.path.join(directory, name), os.path.join(target, name))
+
+
+def get_blob_path(blobs_dir, digest):
+    return os.path.join(blobs_dir, digest[:2], digest[2:])
+
+
+def store_blob(blobs_dir, digest, source, target):
+    # source is a fresh file next to target, it becomes the blob or gets replaced by a link to the existing one
+    blob = get_blob_path(blobs_dir, digest)
+    try:
+        os.link(blob, target)
+    except OSError:
+        os.replace(source, target)
+        try:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.link(target, blob)
+        except OSError:
+            pass
+    else:
+        os.remove(source)
+
+
+def clean_blobs(blobs_dir):
+    # a blob linked only from the store is not used by any game
+    removed, reclaimed = 0, 0
+    for directory, _, files in os.walk(blobs_dir, topdown=False):
+        for name in files:
+            path = os.path.join(directory, name)
+            stat = os.lstat(path)
+            if stat.st_nlink == 1:
+                os.remove(path)
+                removed += 1
+                reclaimed += stat.st_size
+        if directory != blobs_dir and not os.listdir(directory):
+            os.rmdir(directory)
+    return removed, reclaimed
+
+
+def unzip(file, extract_dir, progress=None, blobs_dir=None):
+    with seekable(file) as stream, zipfile.ZipFile(stream) as archive:
+        total = sum(entry.file_size for entry in archive.infolist())
+        extracted = 0
         for entry in archive.infolist():
             name = unquote(entry.filename)
 
@@ -33,8 +120,18 @@ def unzip(filename, extract_dir):
             target = os.path.join(extract_dir, *name.split('/'))
             os.makedirs(os.path.dirname(target), exist_ok=True)
             if not entry.is_dir():  # file
-                with archive.open(entry) as source, open(target, 'wb') as dest:
-                    shutil.copyfileobj(source, dest)
+                dest_path = target + '.part' if blobs_dir else target
+                digest = hashlib.sha256() if blobs_dir else None
+                with archive.open(entry) as source, open(dest_path, 'wb') as dest:
+                    for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                        dest.write(chunk)
+                        if digest is not None:
+                            digest.update(chunk)
+                        extracted += len(chunk)
+                        if progress is not None:
+                            progress(extracted, total)
+                if blobs_dir:
+                    store_blob(blobs_dir, digest.hexdigest(), dest_path, target)
 
 
 hashids = Hashids(salt=settings.SECRET_KEY, min_length=6, alphabet=string.ascii_uppercase + string.digits)
@@ -42,3 +139,10 @@ hashids = Hashids(salt=settings.SECRET_KEY, min_length=6, alphabet=string.ascii_
 
 def generate_token(id):
     return hashids.encode(id)
+
+
+game_executor = ThreadPoolExecutor(max_workers=settings.GAMES_EXECUTOR_WORKERS, thread_name_prefix='games')
+
+
+def game_sync_to_async(func):
+    return database_sync_to_async(func, thread_sensitive=False, executor=game_executor)
@@ -0,0 +1,64 @@
+import json
+
+import msgpack
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+def msgpack_array(count):
+    if count < 16:
+        return bytes([0x90 | count])
+    if count < 2 ** 16:
+        return b'\xdc' + count.to_bytes(2, 'big')
+    return b'\xdd' + count.to_bytes(4, 'big')
+
+
+def cbor_array(count):
+    if count < 24:
+        return bytes([0x80 | count])
+    if count < 2 ** 8:
+        return b'\x98' + count.to_bytes(1, 'big')
+    if count < 2 ** 16:
+        return b'\x99' + count.to_bytes(2, 'big')
+    return b'\x9a' + count.to_bytes(4, 'big')
+
+
+class WireFormat:
+    def __init__(self, name, encode, decode):
+        self.name = name
+        self.encode = encode
+        self.decode = decode
+
+    def join(self, frames):
+        # batch of already encoded frames: {"type": "batch", "message": [...]}
+        return '{"type": "batch", "message": [%s]}' % ', '.join(frames)
+
+
+class BinaryWireFormat(WireFormat):
+    def __init__(self, name, encode, decode, map_header, array_header):
+        super().__init__(name, encode, decode)
+        self.array_header = array_header
+        self.batch_header = map_header + encode('type') + encode('batch') + encode('message')
+
+    def join(self, frames):
+        return self.batch_header + self.array_header(len(frames)) + b''.join(frames)
+
+
+JSON = WireFormat('json', json.dumps, json.loads)
+
+WIRE_FORMATS = {
+    'json': JSON,
+    'msgpack': BinaryWireFormat(
+        'msgpack', lambda payload: msgpack.packb(payload, use_bin_type=True),
+        lambda data: msgpack.unpackb(data, raw=False), b'\x82', msgpack_array
+    ),
+}
+if cbor2 is not None:
+    WIRE_FORMATS['cbor'] = BinaryWireFormat('cbor', cbor2.dumps, cbor2.loads, b'\xa2', cbor_array)
+
+
+def get_wire_format(name):
+    return WIRE_FORMATS.get(name, JSON)
@@ -9,3 +9,4 @@ python3 manage.py migrate --noinput
 echo "Run server"
 python manage.py runserver 0.0.0.0:8000
 #daphne -b 0.0.0.0 -p 8000 bunjgames_server.asgi:application
+#python manage.py runrouter --bind 0.0.0.0:8000 --workers 4
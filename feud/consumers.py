@@ -4,6 +4,7 @@ from feud.serializers import GameSerializer
 
 
 class FeudConsumer(Consumer):
+    button_route = 'button_click'
 
     @property
     def routes(self):
@@ -14,6 +15,9 @@ class FeudConsumer(Consumer):
             answer=lambda game, is_correct, answer_id: game.answer(is_correct, answer_id),
         )
 
+    def is_button_open(self, game):
+        return game.state == Game.STATE_BUTTON and game.answerer_id is None
+
     @property
     def game_name(self):
         return 'feud'
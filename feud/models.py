@@ -2,16 +2,17 @@ import datetime
 import time
 from xml.etree import ElementTree
 
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from django.db import models, transaction
 from django.db.models import Sum
 from django.utils import timezone
 
+from common.broadcast import group_send_sync
+from common.bulk import BulkLoader
+from common.engine import EngineGameMixin
 from common.utils import generate_token, BadFormatException, BadStateException, NothingToDoException
 
 
-class Game(models.Model):
+class Game(EngineGameMixin, models.Model):
     STATE_WAITING_FOR_TEAMS = 'waiting_for_teams'
     STATE_INTRO = 'intro'
     STATE_ROUND = 'round'
@@ -40,7 +41,8 @@ class Game(models.Model):
 
     token = models.CharField(max_length=25, null=True, blank=True, db_index=True)
     created = models.DateTimeField(auto_now_add=True)
-    expired = models.DateTimeField()
+    expired = models.DateTimeField(db_index=True)
+    version = models.PositiveIntegerField(default=0)
     round = models.IntegerField(default=1)
     state = models.CharField(max_length=25, choices=CHOICES_STATE, default=STATE_WAITING_FOR_TEAMS)
     question = models.ForeignKey('Question', on_delete=models.SET_NULL, null=True, related_name='+')
@@ -63,11 +65,7 @@ class Game(models.Model):
         self.set_timer(0)
 
     def intercom(self, message):
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(f'feud_{self.token}', {
-            'type': 'intercom',
-            'message': message
-        })
+        group_send_sync(f'feud_{self.token}', 'intercom', message)
 
     def next_round(self):
         team1 = self.get_teams().first()
@@ -99,46 +97,54 @@ class Game(models.Model):
         game.save(update_fields=['token'])
         return game
 
-    @transaction.atomic(savepoint=False)
-    def parse(self, filename):
+    @staticmethod
+    def read_pack(filename):
         tree = ElementTree.parse(filename)
 
         game_xml = tree.getroot()
         questions_xml = game_xml.find('questions')
+        questions = []
 
         if len(questions_xml.findall('question')) == 0:
             raise BadFormatException('Game should have at least 1 round')
         for question_xml in questions_xml.findall('question'):
-            question = Question.objects.create(
+            questions.append(dict(
                 text=question_xml.find('text').text,
-                game=self,
                 is_final=False,
-            )
-            for answer_xml in question_xml.findall('answer'):
-                answer = Answer.objects.create(
-                    question=question,
+                answers=[dict(
                     text=answer_xml.find('text').text,
                     value=int(answer_xml.find('value').text),
-                )
+                ) for answer_xml in question_xml.findall('answer')],
+            ))
 
         final_questions_xml = game_xml.find('final_questions')
 
         if len(final_questions_xml.findall('question')) != 5:
             raise BadFormatException('Game should have exactly 5 final questions')
         for question_xml in final_questions_xml.findall('question'):
-            question = Question.objects.create(
+            questions.append(dict(
                 text=question_xml.find('text').text,
-                game=self,
                 is_final=True,
-            )
-            for answer_xml in question_xml.findall('answer'):
-                answer = Answer.objects.create(
-                    question=question,
+                answers=[dict(
                     text=answer_xml.find('text').text,
                     value=int(answer_xml.find('value').text),
-                )
+                ) for answer_xml in question_xml.findall('answer')],
+            ))
+        return dict(questions=questions)
+
+    @transaction.atomic(savepoint=False)
+    def load_pack(self, pack):
+        loader = BulkLoader()
+        for question in pack['questions']:
+            question_model = loader.add(Question(text=question['text'], game=self, is_final=question['is_final']))
+            for answer in question['answers']:
+                loader.add(Answer(question=question_model, **answer))
+        loader.save()
         self.save()
 
+    def parse(self, filename):
+        self.load_pack(self.read_pack(filename))
+
     @transaction.atomic(savepoint=False)
     def next_state(self, from_state=None):
         if from_state is not None and self.state != from_state:
@@ -198,14 +204,15 @@ class Game(models.Model):
         if self.state != Game.STATE_BUTTON or self.answerer is not None:
             raise NothingToDoException()
         with transaction.atomic():
-            safe_game = Game.objects.select_for_update().get(id=self.id)
+            safe_game = self.lock_for_update()
             if safe_game.state != Game.STATE_BUTTON or safe_game.answerer is not None:
                 raise NothingToDoException()
 
             safe_game.answerer = safe_game.teams.get(id=team_id)
             safe_game.save(update_fields=['answerer'])
         self.intercom('button')
-        self.refresh_from_db()
+        if safe_game is not self:
+            self.refresh_from_db()
 
     @transaction.atomic(savepoint=False)
     def set_answerer(self, team_id=None):
@@ -49,7 +49,7 @@ class GameSerializer(serializers.Serializer):
     teams = TeamSerializer(many=True)
 
     def get_answerer(self, model: Game):
-        return model.answerer.id if model.answerer else None
+        return model.answerer_id
 
     def get_final_questions(self, model: Game):
         return QuestionSerializer(model.questions.filter(is_final=True).prefetch_related(
@@ -1,23 +1,43 @@
-import logging
-import os
-import shutil
-
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
 from django.db import transaction
+from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from common.utils import unzip, BadStateException, BadFormatException
-from jeopardy.models import Game, Player
+from common.broadcast import group_send_sync
+from common.engine import game_engine
+from common.imports import GameImporter, ImportJob, import_queue
+from common.utils import BadStateException
+from jeopardy.models import Game, Player, Question
 from jeopardy.serializers import GameSerializer
 
 
-logger = logging.getLogger(__name__)
+class JeopardyImporter(GameImporter):
+    game_name = 'jeopardy'
+    model = Game
+    question_model = Question
+    serializer_class = GameSerializer
+
+    @property
+    def media_root(self):
+        return settings.MEDIA_ROOT_JEOPARDY
+
+    def read_pack(self, filename, parsed):
+        rounds = []
+        for themes in Game.iter_rounds(filename):
+            rounds.append(themes)
+            parsed(sum(len(theme['questions']) for theme in themes))
+        return rounds
+
+    def count_questions(self, rounds):
+        return sum(len(theme['questions']) for themes in rounds for theme in themes)
+
+    def get_questions(self, token):
+        return Question.objects.filter(theme__game__token=token)
+
+
+importer = JeopardyImporter()
 
 
 class CreateGameAPI(APIView):
@@ -27,27 +47,13 @@ class CreateGameAPI(APIView):
     def post(self, request):
         game = Game.new()
 
-        data = request.data['game']
-        path = default_storage.save(os.path.join('jeopardy', game.token, 'game'), ContentFile(data.read()))
-        file = os.path.join(settings.MEDIA_ROOT, path)
-        try:
-            unzip(file, os.path.join(settings.MEDIA_ROOT_JEOPARDY, game.token))
-        finally:
-            os.remove(file)
-
-        try:
-            game.parse(os.path.join(settings.MEDIA_ROOT_JEOPARDY, game.token, 'content.xml'))
-            os.remove(os.path.join(settings.MEDIA_ROOT_JEOPARDY, game.token, 'content.xml'))
-        except Exception as e:
-            shutil.rmtree(os.path.join(settings.MEDIA_ROOT_JEOPARDY, game.token), ignore_errors=True)
-            logger.error(str(e))
-            if isinstance(e, BadFormatException) or isinstance(e, BadStateException):
-                raise e
-            raise BadFormatException("Bad game file")
-
-        if not os.listdir(os.path.join(settings.MEDIA_ROOT_JEOPARDY, game.token)):
-            os.rmdir(os.path.join(settings.MEDIA_ROOT_JEOPARDY, game.token))
+        if request.query_params.get('async') == '1':
+            job = ImportJob(f'jeopardy_{game.token}', game.token)
+            filename = import_queue.keep_upload(request.data['game'])
+            transaction.on_commit(lambda: import_queue.submit(job, importer.import_game_job, filename))
+            return Response(job.to_representation(), status=status.HTTP_202_ACCEPTED)
 
+        importer.import_game(game.token, request.data['game'], game.load_pack)
         return Response(GameSerializer().to_representation(game))
 
 
@@ -57,22 +63,20 @@ class RegisterPlayerAPI(APIView):
     @transaction.atomic()
     def post(self, request):
         token, name = request.data['token'].upper().strip(), request.data['name'].upper().strip()
-        try:
-            game = Game.objects.get(token=token)
-        except ObjectDoesNotExist:
-            raise BadStateException('Game not found')
-        try:
-            player = Player.objects.get(game=game, name=name)
-        except ObjectDoesNotExist:
-            if game.state != Game.STATE_WAITING_FOR_PLAYERS:
-                raise BadStateException('Game already started')
-            player = Player.objects.create(game=game, name=name)
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(f'jeopardy_{game.token}', {
-                'type': 'game',
-                'message': GameSerializer().to_representation(game)
+        room_name = f'jeopardy_{token}'
+        with game_engine.lock_room(room_name):
+            try:
+                game = game_engine.get(room_name, lambda: Game.objects.get(token=token))
+            except ObjectDoesNotExist:
+                raise BadStateException('Game not found')
+            try:
+                player = Player.objects.get(game=game, name=name)
+            except ObjectDoesNotExist:
+                if game.state != Game.STATE_WAITING_FOR_PLAYERS:
+                    raise BadStateException('Game already started')
+                player = Player.objects.create(game=game, name=name)
+                group_send_sync(room_name, 'game', GameSerializer().to_representation(game), game.bump_version())
+            return Response({
+                'player_id': player.id,
+                'game': GameSerializer().to_representation(game)
             })
-        return Response({
-            'player_id': player.id,
-            'game': GameSerializer().to_representation(game)
-        })
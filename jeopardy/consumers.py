@@ -1,9 +1,13 @@
+from django.db.models.functions import Coalesce
+
 from common.consumers import Consumer
-from jeopardy.models import Game
+from jeopardy.models import Game, Question
 from jeopardy.serializers import GameSerializer
 
 
 class JeopardyConsumer(Consumer):
+    button_route = 'button_click'
+
     @property
     def routes(self):
         return dict(
@@ -25,8 +29,26 @@ class JeopardyConsumer(Consumer):
     def game_name(self):
         return 'jeopardy'
 
+    def is_button_open(self, game):
+        return game.state == Game.STATE_ANSWER and game.answerer_id is None and \
+            game.question.type == Question.TYPE_STANDARD
+
+    def get_media_manifest_key(self, game):
+        if game.state in (Game.STATE_WAITING_FOR_PLAYERS, Game.STATE_INTRO, Game.STATE_THEMES_ALL,
+                          Game.STATE_ROUND, Game.STATE_GAME_END):
+            return None
+        return game.round
+
+    def get_media_manifest(self, game):
+        rows = Question.objects.filter(theme__in=game.get_themes()).order_by('theme__pk', 'pk').values_list(
+            Coalesce('image_optimized', 'image'), Coalesce('audio_optimized', 'audio'), 'video',
+            Coalesce('answer_image_optimized', 'answer_image'), Coalesce('answer_audio_optimized', 'answer_audio'),
+            'answer_video'
+        )
+        return list(dict.fromkeys(url for row in rows for url in row if url))
+
     def get_game(self, token):
-        return Game.objects.get(token=token)
+        return Game.objects.select_related('question', 'answerer').get(token=token)
 
     def serialize_game(self, game):
         return GameSerializer().to_representation(game)
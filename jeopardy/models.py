@@ -1,17 +1,24 @@
 import datetime
 from xml.etree import ElementTree
 
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models, transaction
 from django.utils import timezone
 
+from common.broadcast import group_send_sync
+from common.bulk import BulkLoader
+from common.engine import EngineGameMixin
 from common.utils import generate_token, BadStateException, NothingToDoException
 
 
-class Game(models.Model):
+def format_media_url(folder, url):
+    if url and url.startswith('@'):
+        return '/' + folder + url.replace('@', '/', 1)
+    return url
+
+
+class Game(EngineGameMixin, models.Model):
     STATE_WAITING_FOR_PLAYERS = 'waiting_for_players'
     STATE_INTRO = 'intro'
     STATE_THEMES_ALL = 'themes_all'
@@ -54,7 +61,8 @@ class Game(models.Model):
 
     token = models.CharField(max_length=25, null=True, blank=True, db_index=True)
     created = models.DateTimeField(auto_now_add=True)
-    expired = models.DateTimeField()
+    expired = models.DateTimeField(db_index=True)
+    version = models.PositiveIntegerField(default=0)
     last_round = models.IntegerField(default=1)
     final_round = models.IntegerField(default=0)  # 0 for no final
     state = models.CharField(max_length=25, choices=CHOICES_STATE, default=STATE_WAITING_FOR_PLAYERS)
@@ -112,135 +120,159 @@ class Game(models.Model):
         game.generate_token()
         return game
 
-    @transaction.atomic(savepoint=False)
-    def parse(self, filename):
-        tree = ElementTree.parse(filename)
-        root = tree.getroot()
+    @staticmethod
+    def read_question(question, namespace, theme_name):
+        type_xml = question.find(namespace + 'type')
+        scenario_xml = question.find(namespace + 'scenario')
+        right_xml = question.find(namespace + 'right')
+        info_xml = question.find(namespace + 'info')
+
+        type = Question.TYPE_STANDARD
+        custom_theme = None
+        if type_xml is not None:
+            type_name = type_xml.get('name')
+            if type_name == 'auction':
+                type = Question.TYPE_AUCTION
+            elif type_name == 'cat' or type_name == 'bagcat':
+                type = Question.TYPE_BAG_CAT
+                for param in type_xml.findall('param'):
+                    if param.get('name') == 'theme':
+                        custom_theme = param.text
+        if not custom_theme:
+            custom_theme = theme_name
+        text = ''
+        image = None
+        audio = None
+        video = None
+
+        marker_flag = False
+        post_text = None
+        post_image = None
+        post_audio = None
+        post_video = None
+
+        for atom in scenario_xml.findall(namespace + 'atom'):
+            atom_type = atom.get('type')
+            if atom_type == 'image':
+                if marker_flag:
+                    post_image = atom.text
+                else:
+                    image = atom.text
+            elif atom_type == 'voice':
+                if marker_flag:
+                    post_audio = atom.text
+                else:
+                    audio = atom.text
+            elif atom_type == 'video':
+                if marker_flag:
+                    post_video = atom.text
+                else:
+                    video = atom.text
+            elif atom_type == 'marker':
+                marker_flag = True
+            elif atom.text:
+                if marker_flag:
+                    post_text = atom.text
+                else:
+                    text = atom.text
+
+        right_answer = ''
+        for answer in right_xml.findall(namespace + 'answer'):
+            right_answer += (answer.text + '   ') if answer.text else ''
+        right_answer = right_answer.strip()
+        comment = ''
+        comments_xml = info_xml.find(namespace + 'comments') if info_xml is not None else None
+        if comments_xml is not None:
+            comment = comments_xml.text
+
+        if settings.JEOPARDY_IS_POST_EVENT_REQUIRED and right_answer \
+                and not post_text and not post_image and not post_audio and not post_video:
+            post_text = right_answer
+
+        return dict(
+            custom_theme=custom_theme,
+            text=text,
+            image=format_media_url('Images', image),
+            audio=format_media_url('Audio', audio),
+            video=format_media_url('Video', video),
+            answer_text=post_text,
+            answer_image=format_media_url('Images', post_image),
+            answer_audio=format_media_url('Audio', post_audio),
+            answer_video=format_media_url('Video', post_video),
+            value=question.get('price'),
+            answer=right_answer,
+            comment=comment,
+            type=type,
+        )
 
-        namespace = root.tag.replace('}package', '}')
+    @staticmethod
+    def iter_rounds(filename):
+        # yields the themes of every round as soon as the round is closed, parsed elements are cleared
+        namespace = None
+        question_tag, theme_tag, round_tag = 'question', 'theme', 'round'
+        themes = []
+        questions = []
+
+        for event, element in ElementTree.iterparse(filename, events=('start-ns', 'end')):
+            if event == 'start-ns':
+                # only the default namespace qualifies the pack tags, prefixed ones (xsi, ...) are skipped
+                prefix, uri = element
+                if namespace is None and not prefix:
+                    namespace = '{%s}' % uri if uri else ''
+                    question_tag, theme_tag, round_tag = (namespace + tag for tag in ('question', 'theme', 'round'))
+            elif element.tag == question_tag:
+                if len(questions) < 8:
+                    questions.append(element)
+                else:
+                    element.clear()
+            elif element.tag == theme_tag:
+                theme_name = element.get('name')
+                themes.append(dict(name=theme_name, questions=[
+                    Game.read_question(question, namespace or '', theme_name) for question in questions
+                ]))
+                questions = []
+                element.clear()
+            elif element.tag == round_tag:
+                yield themes
+                themes = []
+                element.clear()
 
-        last_round = 0
+    @staticmethod
+    def read_pack(filename):
+        return list(Game.iter_rounds(filename))
 
-        def format_image_url(url: str):
-            if url and url.startswith('@'):
-                return '/Images' + url.replace('@', '/', 1)
-            return url
-
-        def format_audio_url(url: str):
-            if url and url.startswith('@'):
-                return '/Audio' + url.replace('@', '/', 1)
-            return url
-
-        def format_video_url(url: str):
-            if url and url.startswith('@'):
-                return '/Video' + url.replace('@', '/', 1)
-            return url
-
-        for i, round in enumerate(root.find(namespace + 'rounds').findall(namespace + 'round')):
-            last_round = i + 1
-            for theme in round.find(namespace + 'themes').findall(namespace + 'theme'):
-                theme_name = theme.get('name')
-                theme_model = Theme.objects.create(name=theme_name, round=i+1, game=self)
-                if theme.find(namespace + 'questions') is None:
-                    continue
-                for question in theme.find(namespace + 'questions').findall(namespace + 'question')[:8]:
-                    question_price = question.get('price')
-                    type = Question.TYPE_STANDARD
-                    custom_theme = None
-                    if question.find(namespace + 'type') is not None:
-                        if question.find(namespace + 'type').get('name') == 'auction':
-                            type = Question.TYPE_AUCTION
-                        elif question.find(namespace + 'type').get('name') == 'cat' \
-                                or question.find(namespace + 'type').get('name') == 'bagcat':
-                            type = Question.TYPE_BAG_CAT
-                            for param in question.find(namespace + 'type').findall('param'):
-                                if param.get('name') == 'theme':
-                                    custom_theme = param.text
-                    if not custom_theme:
-                        custom_theme = theme_name
-                    text = ''
-                    image = None
-                    audio = None
-                    video = None
-
-                    marker_flag = False
-                    post_text = None
-                    post_image = None
-                    post_audio = None
-                    post_video = None
-
-                    for atom in question.find(namespace + 'scenario').findall(namespace + 'atom'):
-                        if atom.get('type') == 'image':
-                            if marker_flag:
-                                post_image = atom.text
-                            else:
-                                image = atom.text
-                        elif atom.get('type') == 'voice':
-                            if marker_flag:
-                                post_audio = atom.text
-                            else:
-                                audio = atom.text
-                        elif atom.get('type') == 'video':
-                            if marker_flag:
-                                post_video = atom.text
-                            else:
-                                video = atom.text
-                        elif atom.get('type') == 'marker':
-                            marker_flag = True
-                        elif atom.text:
-                            if marker_flag:
-                                post_text = atom.text
-                            else:
-                                text = atom.text
-
-                    right_answer = ''
-                    for answer in question.find(namespace + 'right').findall(namespace + 'answer'):
-                        right_answer += (answer.text + '   ') if answer.text else ''
-                    right_answer = right_answer.strip()
-                    comment = ''
-                    if question.find(namespace + 'info') is not None \
-                            and question.find(namespace + 'info').find(namespace + 'comments') is not None:
-                        comment = question.find(namespace + 'info').find(namespace + 'comments').text
-
-                    if settings.JEOPARDY_IS_POST_EVENT_REQUIRED and right_answer \
-                            and not post_text and not post_image and not post_audio and not post_video:
-                        post_text = right_answer
-
-                    Question.objects.create(
-                        custom_theme=custom_theme,
-                        text=text,
-                        image=format_image_url(image),
-                        audio=format_audio_url(audio),
-                        video=format_video_url(video),
-                        answer_text=post_text,
-                        answer_image=format_image_url(post_image),
-                        answer_audio=format_audio_url(post_audio),
-                        answer_video=format_video_url(post_video),
-                        value=question_price,
-                        answer=right_answer,
-                        comment=comment,
-                        type=type,
-                        theme=theme_model
-                    )
-        self.last_round = last_round
-        for round in range(1, last_round+1):
-            max_questions = 0
-            for theme in self.themes.filter(round=round):
-                max_questions = max(theme.questions.count(), max_questions)
-            for theme in self.themes.filter(round=round):
-                for _ in range(max_questions - theme.questions.count()):
-                    Question.objects.create(
+    @transaction.atomic(savepoint=False)
+    def load_pack(self, rounds):
+        loader = BulkLoader()
+        last_round = 0
+        last_round_questions = 0
+        for round in rounds:
+            last_round += 1
+            max_questions = max((len(theme['questions']) for theme in round), default=0)
+            for theme in round:
+                theme_model = loader.add(Theme(name=theme['name'], round=last_round, game=self))
+                for question in theme['questions']:
+                    loader.add(Question(theme=theme_model, **question))
+                for _ in range(max_questions - len(theme['questions'])):
+                    loader.add(Question(
                         answer='-',
                         value=0,
                         comment='-',
                         type=Question.TYPE_STANDARD,
-                        theme=theme,
+                        theme=theme_model,
                         is_processed=True
-                    )
-        if self.themes.filter(round=last_round)[0].questions.count() == 1:
+                    ))
+            last_round_questions = max_questions
+        loader.save()
+
+        self.last_round = last_round
+        if last_round_questions == 1:
             self.final_round = last_round
         self.save()
 
+    def parse(self, filename):
+        self.load_pack(self.iter_rounds(filename))
+
     @transaction.atomic(savepoint=False)
     def next_state(self, from_state):
         if from_state is not None and self.state != from_state:
@@ -328,22 +360,19 @@ class Game(models.Model):
         else:
             self.process_question_end()
         self.save()
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(f'jeopardy_{self.token}', {
-            'type': 'intercom',
-            'message': 'skip'
-        })
+        group_send_sync(f'jeopardy_{self.token}', 'intercom', 'skip')
 
     def button_click(self, player_id):
         with transaction.atomic():
-            safe_game = Game.objects.select_for_update().get(id=self.id)
+            safe_game = self.lock_for_update()
             if safe_game.state != Game.STATE_ANSWER or safe_game.answerer is not None \
                     or safe_game.question.type != Question.TYPE_STANDARD:
                 raise NothingToDoException()
 
             safe_game.answerer = safe_game.players.get(id=player_id)
             safe_game.save()
-        self.refresh_from_db()
+        if safe_game is not self:
+            self.refresh_from_db()
 
     @transaction.atomic(savepoint=False)
     def answer(self, is_right):
@@ -451,6 +480,13 @@ class Theme(models.Model):
 
 
 class Question(models.Model):
+    OPTIMIZED_FIELDS = (
+        ('image', 'image_optimized'),
+        ('audio', 'audio_optimized'),
+        ('answer_image', 'answer_image_optimized'),
+        ('answer_audio', 'answer_audio_optimized'),
+    )
+
     TYPE_STANDARD = 'standard'
     TYPE_AUCTION = 'auction'
     TYPE_BAG_CAT = 'bagcat'
@@ -473,6 +509,10 @@ class Question(models.Model):
     answer_image = models.TextField(null=True)
     answer_audio = models.TextField(null=True)
     answer_video = models.TextField(null=True)
+    image_optimized = models.TextField(null=True)
+    audio_optimized = models.TextField(null=True)
+    answer_image_optimized = models.TextField(null=True)
+    answer_audio_optimized = models.TextField(null=True)
     value = models.IntegerField()
     comment = models.TextField()
     type = models.CharField(max_length=25, choices=CHOICES_TYPE)
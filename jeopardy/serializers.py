@@ -20,13 +20,13 @@ class QuestionSerializer(serializers.Serializer):
     custom_theme = serializers.CharField()
 
     text = serializers.CharField()
-    image = serializers.CharField()
-    audio = serializers.CharField()
+    image = SerializerMethodField()
+    audio = SerializerMethodField()
     video = serializers.CharField()
 
     answer_text = serializers.CharField()
-    answer_image = serializers.CharField()
-    answer_audio = serializers.CharField()
+    answer_image = SerializerMethodField()
+    answer_audio = SerializerMethodField()
     answer_video = serializers.CharField()
 
     value = serializers.IntegerField()
@@ -35,6 +35,18 @@ class QuestionSerializer(serializers.Serializer):
     type = serializers.CharField()
     is_processed = serializers.BooleanField()
 
+    def get_image(self, model: Question):
+        return model.image_optimized or model.image
+
+    def get_audio(self, model: Question):
+        return model.audio_optimized or model.audio
+
+    def get_answer_image(self, model: Question):
+        return model.answer_image_optimized or model.answer_image
+
+    def get_answer_audio(self, model: Question):
+        return model.answer_audio_optimized or model.answer_audio
+
     class Meta:
         model = Question
 
@@ -63,13 +75,13 @@ class GameSerializer(serializers.Serializer):
     name = serializers.ReadOnlyField(default='jeopardy')
 
     def get_themes(self, model: Game):
-        return ThemeSerializer(many=True).to_representation(model.get_themes())
+        return ThemeSerializer(many=True).to_representation(model.get_themes().prefetch_related('questions'))
 
     def get_is_final_round(self, model: Game):
         return model.is_final_round()
 
     def get_answerer(self, model: Game):
-        return model.answerer.id if model.answerer else None
+        return model.answerer_id
 
     class Meta:
         model = Game
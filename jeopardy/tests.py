@@ -0,0 +1,257 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import wave
+import zipfile
+from array import array
+from unittest import mock
+
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from common.imports import import_queue
+from common.metrics import metrics
+from common.testing import QueryCountMixin
+from common.transcode import Transcoder, transcoder
+from jeopardy.api import importer
+from jeopardy.consumers import JeopardyConsumer
+from jeopardy.models import Game, Theme, Question, Player
+from jeopardy.serializers import QuestionSerializer
+
+
+def make_pack(rounds, attributes='xmlns="http://vladimirkhil.com/ygpackage3.0.xsd"'):
+    themes_xml = lambda themes: ''.join(
+        '<theme name="%s"><questions>%s</questions></theme>' % (name, ''.join(
+            '<question price="%d"><scenario><atom>Q%d</atom><atom type="marker"/>'
+            '<atom type="image">@%d.png</atom></scenario><right><answer>A%d</answer></right></question>'
+            % ((i + 1) * 100, i, i, i) for i in range(count)
+        )) for name, count in themes
+    )
+    return io.BytesIO((
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<package %s><rounds>%s</rounds></package>' % (attributes, ''.join(
+            '<round name="%d"><themes>%s</themes></round>' % (i, themes_xml(themes)) for i, themes in enumerate(rounds)
+        ))
+    ).encode())
+
+
+class GameParseTestCase(TestCase):
+
+    def test_parse(self):
+        game = Game.new()
+        pack = make_pack([[('a', 3), ('b', 2)], [('c', 5)], [('final', 1), ('final 2', 1)]])
+        with CaptureQueriesContext(connection) as queries:
+            game.parse(pack)
+        self.assertLessEqual(len(queries), 4)
+
+        game.refresh_from_db()
+        self.assertEqual(game.last_round, 3)
+        self.assertEqual(game.final_round, 3)
+        self.assertEqual([theme.name for theme in game.themes.all()], ['a', 'b', 'c', 'final', 'final 2'])
+
+        padded = game.themes.get(name='b').questions.all()
+        self.assertEqual([question.value for question in padded], [100, 200, 0])
+        self.assertEqual([question.is_processed for question in padded], [False, False, True])
+
+        question = game.themes.get(name='c').questions.last()
+        self.assertEqual(question.text, 'Q4')
+        self.assertEqual(question.answer, 'A4')
+        self.assertEqual(question.answer_image, '/Images/4.png')
+        self.assertEqual(question.custom_theme, 'c')
+
+    def test_parse_prefixed_namespace_first(self):
+        game = Game.new()
+        game.parse(make_pack([[('a', 2)], [('b', 1)]], attributes=(
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns="http://vladimirkhil.com/ygpackage3.0.xsd"'
+        )))
+        game.refresh_from_db()
+        self.assertEqual([theme.name for theme in game.themes.all()], ['a', 'b'])
+        self.assertEqual(game.themes.get(name='a').questions.first().text, 'Q0')
+
+    def test_parse_without_final(self):
+        game = Game.new()
+        game.parse(make_pack([[('a', 2)], [('b', 2)]]))
+        game.refresh_from_db()
+        self.assertEqual(game.last_round, 2)
+        self.assertEqual(game.final_round, 0)
+
+
+class ImportJobTestCase(TransactionTestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = override_settings(
+            MEDIA_ROOT_JEOPARDY=os.path.join(media_root, 'jeopardy'),
+            MEDIA_ROOT_BLOBS=os.path.join(media_root, 'blobs'),
+            MEDIA_ROOT_PACKS=os.path.join(media_root, 'packs'),
+            MEDIA_ROOT_RENDITIONS=os.path.join(media_root, 'renditions'),
+        )
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    @staticmethod
+    def make_archive(data):
+        pack = io.BytesIO()
+        with zipfile.ZipFile(pack, 'w') as archive:
+            archive.writestr('content.xml', data)
+            archive.writestr('Images/1.png', b'image')
+        pack.name = 'pack.siq'
+        pack.seek(0)
+        return pack
+
+    def create(self, data):
+        response = self.client.post('/jeopardy/v1/create?async=1', {'game': self.make_archive(data)})
+        self.assertEqual(response.status_code, 202)
+        return response.json()
+
+    def wait(self, job):
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            status = self.client.get(f'/common/v1/imports/{job["job"]}').json()
+            if status['state'] in ('done', 'failed'):
+                return status
+            time.sleep(0.05)
+        self.fail('Import did not finish')
+
+    def test_import(self):
+        job = self.create(make_pack([[('a', 3), ('b', 2)], [('final', 1)]]).getvalue())
+        self.assertEqual(job['state'], 'queued')
+
+        status = self.wait(job)
+        self.assertEqual(status['state'], 'done')
+        self.assertEqual(status['questions_parsed'], 6)
+        self.assertEqual(status['bytes_extracted'], status['bytes_total'])
+
+        game = Game.objects.get(token=job['token'])
+        self.assertEqual(game.final_round, 2)
+        self.assertEqual(Question.objects.filter(theme__game=game).count(), 7)
+
+        # another worker only has the stored status
+        import_queue.jobs.pop(job['job'])
+        self.assertEqual(self.wait(job), status)
+
+    def test_import_cached_pack(self):
+        data = make_pack([[('a', 3), ('b', 2)], [('final', 1)]]).getvalue()
+        hits = metrics.get().get('pack_cache_hits', 0)
+        tokens = [
+            self.client.post('/jeopardy/v1/create', {'game': self.make_archive(data)}).json()['token']
+            for _ in range(2)
+        ]
+        self.assertEqual(metrics.get()['pack_cache_hits'], hits + 1)
+
+        first, second = (Game.objects.get(token=token) for token in tokens)
+        self.assertEqual(second.final_round, 2)
+        self.assertEqual(
+            list(Question.objects.filter(theme__game=first).values_list('theme__name', 'value', 'answer')),
+            list(Question.objects.filter(theme__game=second).values_list('theme__name', 'value', 'answer')),
+        )
+        first_image, second_image = (
+            os.stat(os.path.join(settings.MEDIA_ROOT_JEOPARDY, token, 'Images', '1.png')) for token in tokens
+        )
+        self.assertEqual(first_image.st_ino, second_image.st_ino)
+
+    def test_import_failed(self):
+        job = self.create(b'<package')
+        status = self.wait(job)
+        self.assertEqual(status['state'], 'failed')
+        self.assertEqual(status['error'], 'Bad game file')
+        self.assertFalse(Game.objects.filter(token=job['token']).exists())
+
+    def test_optimize_media(self):
+        token = self.client.post('/jeopardy/v1/create', {
+            'game': self.make_archive(make_pack([[('a', 2)]]).getvalue())
+        }).json()['token']
+        directory = os.path.join(settings.MEDIA_ROOT_JEOPARDY, token)
+        os.makedirs(os.path.join(directory, 'Audio'))
+        with wave.open(os.path.join(directory, 'Audio', '1.wav'), 'wb') as writer:
+            writer.setnchannels(2)
+            writer.setsampwidth(2)
+            writer.setframerate(44100)
+            writer.writeframes(array('h', [1000, 3000] * 44100).tobytes())
+        Question.objects.filter(theme__game__token=token).update(audio='/Audio/1.wav')
+
+        def link(rendition, target):
+            # the reaper cleans the rendition before the first link, it is rendered again
+            if not renditions:
+                os.remove(rendition)
+            renditions.append(rendition)
+            Transcoder.link(rendition, target)
+        renditions = []
+        with mock.patch.object(transcoder, 'link', side_effect=link):
+            importer.optimize_game(token)
+        self.assertEqual(len(renditions), 2)
+
+        question = Question.objects.filter(theme__game__token=token).first()
+        self.assertEqual(question.audio_optimized, '/optimized/Audio/1.wav.wav')
+        with wave.open(os.path.join(directory, 'optimized', 'Audio', '1.wav.wav'), 'rb') as reader:
+            self.assertEqual((reader.getnchannels(), reader.getframerate()), (1, 22050))
+            self.assertEqual(array('h', reader.readframes(2)).tolist(), [2000, 2000])
+        data = QuestionSerializer().to_representation(question)
+        self.assertEqual(data['audio'], '/optimized/Audio/1.wav.wav')
+        self.assertNotIn('audio_original', data)
+
+        # the rendition made with the old limits is not reused
+        with override_settings(GAMES_MEDIA_MAX_AUDIO_RATE=11025):
+            importer.optimize_game(token)
+        with wave.open(os.path.join(directory, 'optimized', 'Audio', '1.wav.wav'), 'rb') as reader:
+            self.assertEqual(reader.getframerate(), 11025)
+
+
+class MediaManifestTestCase(TestCase):
+
+    def test_manifest_once_per_round(self):
+        game = Game.new()
+        game.parse(make_pack([[('a', 2), ('b', 2)], [('c', 1)]]))
+        consumer = JeopardyConsumer()
+        consumer.room_name = f'jeopardy_{game.token}'
+        self.assertEqual(consumer.make_manifest_events(game), [])
+
+        game.state = Game.STATE_ROUND_THEMES
+        event, = consumer.make_manifest_events(game, only_new=True)
+        self.assertEqual(json.loads(event['frame']), {'type': 'media_manifest', 'message': {
+            'key': 1, 'media': ['/Images/0.png', '/Images/1.png']
+        }})
+
+        game.state = Game.STATE_QUESTIONS
+        with self.assertNumQueries(0):
+            self.assertEqual(consumer.make_manifest_events(game, only_new=True), [])
+            self.assertEqual(len(consumer.make_manifest_events(game)), 1)
+
+        game.round = 2
+        event, = consumer.make_manifest_events(game, only_new=True)
+        self.assertEqual(json.loads(event['frame'])['message'], {'key': 2, 'media': ['/Images/0.png']})
+
+
+class GameSerializerTestCase(QueryCountMixin, TestCase):
+    consumer_class = JeopardyConsumer
+
+    @staticmethod
+    def create_game(themes_count, questions_count):
+        game = Game.new()
+        for i in range(themes_count):
+            theme = Theme.objects.create(game=game, name=str(i), round=1)
+            for j in range(questions_count):
+                Question.objects.create(theme=theme, value=(j + 1) * 100, answer='-', comment='-',
+                                        type=Question.TYPE_STANDARD)
+        Player.objects.create(game=game, name='1')
+        Player.objects.create(game=game, name='2')
+        game.state = Game.STATE_ANSWER
+        game.question = theme.questions.first()
+        game.answerer = game.players.first()
+        game.save()
+        return game
+
+    def test_constant_query_count(self):
+        small_count, small_data = self.count_queries(self.create_game(1, 1))
+        large_count, large_data = self.count_queries(self.create_game(6, 5))
+        self.assertEqual(small_count, large_count)
+        self.assertEqual(len(large_data['themes']), 6)
+        self.assertEqual(len(large_data['themes'][5]['questions']), 5)
+        self.assertIsNotNone(large_data['question'])
+        self.assertEqual(large_data['answerer'], Player.objects.get(game__token=large_data['token'], name='1').id)
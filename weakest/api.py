@@ -1,18 +1,14 @@
 import logging
-import os
-import shutil
 
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
 from django.db import transaction
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from common.utils import unzip, BadStateException, BadFormatException
+from common.broadcast import group_send_sync
+from common.engine import game_engine
+from common.packs import pack_cache
+from common.utils import get_file_digest, BadStateException, BadFormatException
 from weakest.models import Game, Player
 from weakest.serializers import GameSerializer
 
@@ -27,20 +23,18 @@ class CreateGameAPI(APIView):
     def post(self, request):
         game = Game.new()
 
-        data = request.data['game']
-        path = default_storage.save(os.path.join('weakest', game.token, 'game'), ContentFile(data.read()))
-        file = os.path.join(settings.MEDIA_ROOT, path)
-
         try:
-            game.parse(file)
+            digest = get_file_digest(request.data['game'])
+            pack = pack_cache.get('weakest', digest)
+            if pack is None:
+                pack = Game.read_pack(request.data['game'])
+                pack_cache.put('weakest', digest, pack)
+            game.load_pack(pack)
         except (BadFormatException, BadStateException) as e:
             raise e
         except Exception as e:
             logger.error(str(e))
             raise BadFormatException("Bad game file")
-        finally:
-            os.remove(file)
-            shutil.rmtree(os.path.join(settings.MEDIA_ROOT_WEAKEST, game.token), ignore_errors=True)
 
         return Response(GameSerializer().to_representation(game))
 
@@ -51,22 +45,20 @@ class RegisterPlayerAPI(APIView):
     @transaction.atomic()
     def post(self, request):
         token, name = request.data['token'].upper().strip(), request.data['name'].upper().strip()
-        try:
-            game = Game.objects.get(token=token)
-        except ObjectDoesNotExist:
-            raise BadStateException('Game not found')
-        try:
-            player = Player.objects.get(game=game, name=name)
-        except ObjectDoesNotExist:
-            if game.state != Game.STATE_WAITING_FOR_PLAYERS:
-                raise BadStateException('Game already started')
-            player = Player.objects.create(game=game, name=name)
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(f'weakest_{game.token}', {
-                'type': 'game',
-                'message': GameSerializer().to_representation(game)
+        room_name = f'weakest_{token}'
+        with game_engine.lock_room(room_name):
+            try:
+                game = game_engine.get(room_name, lambda: Game.objects.get(token=token))
+            except ObjectDoesNotExist:
+                raise BadStateException('Game not found')
+            try:
+                player = Player.objects.get(game=game, name=name)
+            except ObjectDoesNotExist:
+                if game.state != Game.STATE_WAITING_FOR_PLAYERS:
+                    raise BadStateException('Game already started')
+                player = Player.objects.create(game=game, name=name)
+                group_send_sync(room_name, 'game', GameSerializer().to_representation(game), game.bump_version())
+            return Response({
+                'player_id': player.id,
+                'game': GameSerializer().to_representation(game)
             })
-        return Response({
-            'player_id': player.id,
-            'game': GameSerializer().to_representation(game)
-        })
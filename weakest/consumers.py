@@ -15,6 +15,14 @@ class WeakestConsumer(Consumer):
             select_final_answerer=lambda game, player_id: game.select_final_answerer(player_id),
         )
 
+    def get_timer(self, game):
+        if game.state != Game.STATE_QUESTIONS:
+            return None
+        return game.timer, False
+
+    def timer_expired(self, game):
+        game.next_state(Game.STATE_QUESTIONS)
+
     @property
     def game_name(self):
         return 'weakest'
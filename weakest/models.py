@@ -6,10 +6,12 @@ from django.db import models, transaction
 from django.db.models import Count, Q, F, Subquery, OuterRef
 from django.utils import timezone
 
+from common.bulk import BulkLoader
+from common.engine import EngineGameMixin
 from common.utils import generate_token, BadFormatException, BadStateException, NothingToDoException
 
 
-class Game(models.Model):
+class Game(EngineGameMixin, models.Model):
     STATE_WAITING_FOR_PLAYERS = 'waiting_for_players'
     STATE_INTRO = 'intro'
     STATE_ROUND = 'round'
@@ -35,7 +37,8 @@ class Game(models.Model):
 
     token = models.CharField(max_length=25, null=True, blank=True, db_index=True)
     created = models.DateTimeField(auto_now_add=True)
-    expired = models.DateTimeField()
+    expired = models.DateTimeField(db_index=True)
+    version = models.PositiveIntegerField(default=0)
     score_multiplier = models.IntegerField(default=1)
     score = models.IntegerField(default=0)
     bank = models.IntegerField(default=0)
@@ -146,37 +149,47 @@ class Game(models.Model):
         game.save()
         return game
 
-    @transaction.atomic(savepoint=False)
-    def parse(self, filename):
+    @staticmethod
+    def read_pack(filename):
         tree = ElementTree.parse(filename)
 
         game_xml = tree.getroot()
         questions_xml = game_xml.find('questions')
+        questions = []
 
         for question_number, question_xml in enumerate(questions_xml.findall('question')):
-            question = Question.objects.create(
+            questions.append(dict(
                 question=question_xml.find('question').text,
                 answer=question_xml.find('answer').text,
-                game=self,
                 is_final=False,
-            )
+            ))
 
         final_questions_xml = game_xml.find('final_questions')
 
         if len(final_questions_xml.findall('question')) < 10:
             raise BadFormatException('Number of final questions must be 10 or more')
         for question_number, question_xml in enumerate(final_questions_xml.findall('question')):
-            question = Question.objects.create(
+            questions.append(dict(
                 question=question_xml.find('question').text,
                 answer=question_xml.find('answer').text,
-                game=self,
                 is_final=True,
-            )
+            ))
 
         score_multiplier_xml = game_xml.find('score_multiplier')
-        self.score_multiplier = int(score_multiplier_xml.text)
+        return dict(score_multiplier=int(score_multiplier_xml.text), questions=questions)
+
+    @transaction.atomic(savepoint=False)
+    def load_pack(self, pack):
+        loader = BulkLoader()
+        for question in pack['questions']:
+            loader.add(Question(game=self, **question))
+        self.score_multiplier = pack['score_multiplier']
+        loader.save()
         self.save()
 
+    def parse(self, filename):
+        self.load_pack(self.read_pack(filename))
+
     @transaction.atomic(savepoint=False)
     def next_state(self, from_state=None):
         if from_state is not None and self.state != from_state:
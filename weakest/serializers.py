@@ -13,7 +13,7 @@ class PlayerSerializer(serializers.Serializer):
     bank_income = serializers.IntegerField()
 
     def get_weak(self, model: Player):
-        return model.weak.id if model.weak else None
+        return model.weak_id
 
     class Meta:
         model = Player
@@ -44,13 +44,13 @@ class GameSerializer(serializers.Serializer):
     players = PlayerSerializer(many=True)
 
     def get_answerer(self, model: Game):
-        return model.answerer.id if model.answerer else None
+        return model.answerer_id
 
     def get_weakest(self, model: Game):
-        return model.weakest.id if model.weakest else None
+        return model.weakest_id
 
     def get_strongest(self, model: Game):
-        return model.strongest.id if model.strongest else None
+        return model.strongest_id
 
     class Meta:
         model = Game
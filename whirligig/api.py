@@ -1,20 +1,37 @@
-import logging
-import os
-import shutil
-
 from django.conf import settings
-from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
 from django.db import transaction
+from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from common.utils import unzip, BadFormatException, BadStateException
-from whirligig.models import Game
+from common.imports import GameImporter, ImportJob, import_queue
+from whirligig.models import Game, Question
 from whirligig.serializers import GameSerializer
 
 
-logger = logging.getLogger(__name__)
+class WhirligigImporter(GameImporter):
+    game_name = 'whirligig'
+    model = Game
+    question_model = Question
+    serializer_class = GameSerializer
+
+    @property
+    def media_root(self):
+        return settings.MEDIA_ROOT_WHIRLIGIG
+
+    def read_pack(self, filename, parsed):
+        pack = Game.read_pack(filename)
+        parsed(self.count_questions(pack))
+        return pack
+
+    def count_questions(self, pack):
+        return sum(len(item['questions']) for item in pack['items'])
+
+    def get_questions(self, token):
+        return Question.objects.filter(item__game__token=token)
+
+
+importer = WhirligigImporter()
 
 
 class CreateGameAPI(APIView):
@@ -24,25 +41,11 @@ class CreateGameAPI(APIView):
     def post(self, request):
         game = Game.new()
 
-        data = request.data['game']
-        path = default_storage.save(os.path.join('whirligig', game.token, 'game'), ContentFile(data.read()))
-        file = os.path.join(settings.MEDIA_ROOT, path)
-        try:
-            unzip(file, os.path.join(settings.MEDIA_ROOT_WHIRLIGIG, game.token))
-        finally:
-            os.remove(file)
-
-        try:
-            game.parse(os.path.join(settings.MEDIA_ROOT_WHIRLIGIG, game.token, 'content.xml'))
-            os.remove(os.path.join(settings.MEDIA_ROOT_WHIRLIGIG, game.token, 'content.xml'))
-        except Exception as e:
-            shutil.rmtree(os.path.join(settings.MEDIA_ROOT_WHIRLIGIG, game.token), ignore_errors=True)
-            logger.error(str(e))
-            if isinstance(e, BadFormatException) or isinstance(e, BadStateException):
-                raise e
-            raise BadFormatException("Bad game file")
-
-        if not os.listdir(os.path.join(settings.MEDIA_ROOT_WHIRLIGIG, game.token)):
-            os.rmdir(os.path.join(settings.MEDIA_ROOT_WHIRLIGIG, game.token))
+        if request.query_params.get('async') == '1':
+            job = ImportJob(f'whirligig_{game.token}', game.token)
+            filename = import_queue.keep_upload(request.data['game'])
+            transaction.on_commit(lambda: import_queue.submit(job, importer.import_game_job, filename))
+            return Response(job.to_representation(), status=status.HTTP_202_ACCEPTED)
 
+        importer.import_game(game.token, request.data['game'], game.load_pack)
         return Response(GameSerializer().to_representation(game))
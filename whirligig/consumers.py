@@ -1,5 +1,7 @@
+from django.db.models.functions import Coalesce
+
 from common.consumers import Consumer
-from whirligig.models import Game
+from whirligig.models import Game, Question
 from whirligig.serializers import GameSerializer
 
 
@@ -20,6 +22,27 @@ class WhirligigConsumer(Consumer):
     def game_name(self):
         return 'whirligig'
 
+    def get_timer(self, game):
+        if game.state != Game.STATE_QUESTION_DISCUSSION or not game.timer_time:
+            return None
+        return game.timer_time, game.timer_paused
+
+    def timer_expired(self, game):
+        game.next_state(Game.STATE_QUESTION_DISCUSSION)
+
+    def get_media_manifest_key(self, game):
+        if game.state in (Game.STATE_START, Game.STATE_END):
+            return None
+        return 'items'
+
+    def get_media_manifest(self, game):
+        rows = Question.objects.filter(item__game=game).order_by('item__number', 'number').values_list(
+            Coalesce('image_optimized', 'image'), Coalesce('audio_optimized', 'audio'), 'video',
+            Coalesce('answer_image_optimized', 'answer_image'), Coalesce('answer_audio_optimized', 'answer_audio'),
+            'answer_video'
+        )
+        return list(dict.fromkeys(url for row in rows for url in row if url))
+
     def get_game(self, token):
         return Game.objects.get(token=token)
 
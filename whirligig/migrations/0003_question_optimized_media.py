@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whirligig', '0002_auto_20201218_1550'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='answer_audio_optimized',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='answer_image_optimized',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='audio_optimized',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='image_optimized',
+            field=models.CharField(max_length=255, null=True),
+        ),
+    ]
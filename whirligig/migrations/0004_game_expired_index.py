@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whirligig', '0003_question_optimized_media'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='game',
+            name='expired',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
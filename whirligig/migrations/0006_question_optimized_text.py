@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whirligig', '0005_game_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='question',
+            name='answer_audio_optimized',
+            field=models.TextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='question',
+            name='answer_image_optimized',
+            field=models.TextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='question',
+            name='audio_optimized',
+            field=models.TextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='question',
+            name='image_optimized',
+            field=models.TextField(null=True),
+        ),
+    ]
@@ -7,10 +7,12 @@ from xml.etree import ElementTree
 
 from django.db import models, transaction
 
+from common.bulk import BulkLoader
+from common.engine import EngineGameMixin
 from common.utils import generate_token, BadFormatException, BadStateException, NothingToDoException
 
 
-class Game(models.Model):
+class Game(EngineGameMixin, models.Model):
     STATE_START = 'start'
     STATE_INTRO = 'intro'
     STATE_QUESTIONS = 'questions'
@@ -41,7 +43,8 @@ class Game(models.Model):
 
     token = models.CharField(max_length=25, null=True, blank=True, db_index=True)
     created = models.DateTimeField(auto_now_add=True)
-    expired = models.DateTimeField()
+    expired = models.DateTimeField(db_index=True)
+    version = models.PositiveIntegerField(default=0)
     connoisseurs_score = models.IntegerField(default=0)
     viewers_score = models.IntegerField(default=0)
     cur_random_item = models.IntegerField(default=None, null=True)
@@ -136,30 +139,31 @@ class Game(models.Model):
         self.state = self.STATE_QUESTION_DISCUSSION
         self.save()
 
-    @transaction.atomic(savepoint=False)
-    def parse(self, filename):
+    @staticmethod
+    def read_pack(filename):
         tree = ElementTree.parse(filename)
 
         game_xml = tree.getroot()
         items_xml = game_xml.find('items')
+        items = []
 
         for item_number, item_xml in enumerate(items_xml.findall('item')):
             if item_number >= 13:
                 raise BadFormatException('Too many items')
-            item = GameItem.objects.create(
+            questions = []
+            items.append(dict(
                 number=item_number,
                 name=item_xml.find('name').text,
                 description=item_xml.find('description').text if item_xml.find('description') is not None else '',
-                game=self,
                 type=item_xml.find('type').text,
-            )
+                questions=questions,
+            ))
             for question_number, question_xml in enumerate(item_xml.find('questions').findall('question')):
                 if question_number >= 3:
                     raise BadFormatException('Too many questions')
                 answer_xml = question_xml.find('answer')
-                question = Question.objects.create(
+                questions.append(dict(
                     number=question_number,
-                    item=item,
                     description=question_xml.find('description').text,
                     text=question_xml.find('text').text,
                     image=question_xml.find('image').text,
@@ -171,7 +175,22 @@ class Game(models.Model):
                     answer_image=answer_xml.find('image').text,
                     answer_audio=answer_xml.find('audio').text,
                     answer_video=answer_xml.find('video').text,
-                )
+                ))
+        return dict(items=items)
+
+    @transaction.atomic(savepoint=False)
+    def load_pack(self, pack):
+        loader = BulkLoader()
+        for item in pack['items']:
+            item_model = loader.add(GameItem(
+                game=self, **{key: value for key, value in item.items() if key != 'questions'}
+            ))
+            for question in item['questions']:
+                loader.add(Question(item=item_model, **question))
+        loader.save()
+
+    def parse(self, filename):
+        self.load_pack(self.read_pack(filename))
 
     def print(self):
         for item in self.items.iterator():
@@ -275,6 +294,13 @@ class GameItem(models.Model):
 
 
 class Question(models.Model):
+    OPTIMIZED_FIELDS = (
+        ('image', 'image_optimized'),
+        ('audio', 'audio_optimized'),
+        ('answer_image', 'answer_image_optimized'),
+        ('answer_audio', 'answer_audio_optimized'),
+    )
+
     number = models.IntegerField()
     item = models.ForeignKey(GameItem, on_delete=models.CASCADE, related_name='questions')
     is_processed = models.BooleanField(default=False)
@@ -290,6 +316,10 @@ class Question(models.Model):
     answer_image = models.CharField(max_length=255, null=True)
     answer_audio = models.CharField(max_length=255, null=True)
     answer_video = models.CharField(max_length=255, null=True)
+    image_optimized = models.TextField(null=True)
+    audio_optimized = models.TextField(null=True)
+    answer_image_optimized = models.TextField(null=True)
+    answer_audio_optimized = models.TextField(null=True)
 
     class Meta:
         ordering = ['number']
@@ -1,6 +1,8 @@
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 from rest_framework.fields import SerializerMethodField
 
+from common.utils import BadStateException
 from whirligig.models import Game, GameItem, Question
 
 
@@ -10,16 +12,28 @@ class QuestionSerializer(serializers.Serializer):
 
     description = serializers.CharField()
     text = serializers.CharField()
-    image = serializers.CharField()
-    audio = serializers.CharField()
+    image = SerializerMethodField()
+    audio = SerializerMethodField()
     video = serializers.CharField()
 
     answer_description = serializers.CharField()
     answer_text = serializers.CharField()
-    answer_image = serializers.CharField()
-    answer_audio = serializers.CharField()
+    answer_image = SerializerMethodField()
+    answer_audio = SerializerMethodField()
     answer_video = serializers.CharField()
 
+    def get_image(self, model: Question):
+        return model.image_optimized or model.image
+
+    def get_audio(self, model: Question):
+        return model.audio_optimized or model.audio
+
+    def get_answer_image(self, model: Question):
+        return model.answer_image_optimized or model.answer_image
+
+    def get_answer_audio(self, model: Question):
+        return model.answer_audio_optimized or model.answer_audio
+
     class Meta:
         model = Question
 
@@ -53,19 +67,32 @@ class GameSerializer(serializers.Serializer):
     timer_time = serializers.IntegerField()
     name = serializers.ReadOnlyField(default='whirligig')
 
+    def to_representation(self, instance):
+        prefetch_related_objects([instance], 'items__questions')
+        return super().to_representation(instance)
+
+    @staticmethod
+    def find_cur_item(model: Game):
+        if model.state not in (model.STATE_QUESTION_START, model.STATE_QUESTION_DISCUSSION,
+                               model.STATE_ANSWER, model.STATE_RIGHT_ANSWER):
+            return None
+        item = next((item for item in model.items.all() if item.number == model.cur_item), None)
+        if item is None:
+            raise BadStateException('Current item not found')
+        return item
+
     def get_cur_item(self, model: Game):
-        item = model.items.get(number=model.cur_item) \
-            if model.state in (model.STATE_QUESTION_START, model.STATE_QUESTION_DISCUSSION,
-                               model.STATE_ANSWER, model.STATE_RIGHT_ANSWER) \
-            else None
+        item = self.find_cur_item(model)
         return GameItemSerializer().to_representation(item) if item else None
 
     def get_cur_question(self, model: Game):
-        question = model.items.get(number=model.cur_item).questions.get(number=model.cur_question) \
-            if model.state in (model.STATE_QUESTION_START, model.STATE_QUESTION_DISCUSSION,
-                               model.STATE_ANSWER, model.STATE_RIGHT_ANSWER) \
-            else None
-        return QuestionSerializer().to_representation(question) if question else None
+        item = self.find_cur_item(model)
+        if item is None:
+            return None
+        question = next((question for question in item.questions.all() if question.number == model.cur_question), None)
+        if question is None:
+            raise BadStateException('Current question not found')
+        return QuestionSerializer().to_representation(question)
 
     class Meta:
         model = Game
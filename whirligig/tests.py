@@ -1,77 +1,38 @@
-# from django.test import TestCase
-# from django.urls import reverse
-# from rest_framework import status
-# from rest_framework.test import APITestCase
-#
-# from whirligig.models import Game
+from django.test import TestCase
 
+from common.testing import QueryCountMixin
+from common.utils import BadStateException
+from whirligig.consumers import WhirligigConsumer
+from whirligig.models import Game, GameItem, Question
+from whirligig.serializers import GameSerializer
 
-# class GameXMLParsingTestCase(TestCase):
-#
-#     def test_parse_game_xml(self):
-#         game = Game.new()
-#         game.parse('content.xml')
-#         self.assertGreater(game.items.count(), 0)
-#         for item in game.items.iterator():
-#             self.assertGreater(item.questions.count(), 0)
-#             for question in item.questions.iterator():
-#                 self.assertGreater(len(question.description), 0)
-#                 self.assertGreater(len(question.answer_description), 0)
 
+class GameSerializerTestCase(QueryCountMixin, TestCase):
+    consumer_class = WhirligigConsumer
 
-# class GameAPITestCase(APITestCase):
-#     CREATE_GAME_URL = reverse('create_game')
-#     GAME_URL = reverse('game')
-#     NEXT_STATE_URL = reverse('next_state')
-#
-#     def test_game_api(self):
-#         # Creating game
-#         with open('game.whirligig', 'rb') as file:
-#             response = self.client.post(self.CREATE_GAME_URL, dict(game=file), format="multipart")
-#         self.assertEqual(response.status_code, status.HTTP_200_OK)
-#         game = response.json()
-#         self.assertGreater(len(game['token']), 0)
-#
-#         # Retrieving game
-#         response = self.client.get(self.GAME_URL, dict(token=game['token']))
-#         self.assertEqual(response.status_code, status.HTTP_200_OK)
-#         self.assertEqual(response.json()['token'], game['token'])
-#         self.assertEqual(response.json()['state'], Game.STATE_START)
-#
-#         # Iterating through game states
-#         response = self.client.post(self.NEXT_STATE_URL, dict(token=game['token']))
-#         self.assertEqual(response.status_code, status.HTTP_200_OK)
-#         self.assertEqual(response.json()['state'], Game.STATE_INTRO)
-#
-#         response = self.client.post(self.NEXT_STATE_URL, dict(token=game['token']))
-#         self.assertEqual(response.status_code, status.HTTP_200_OK)
-#         self.assertEqual(response.json()['state'], Game.STATE_QUESTIONS)
-#
-#         for item in game['items']:
-#             response = self.client.post(self.NEXT_STATE_URL, dict(token=game['token']))
-#             self.assertEqual(response.status_code, status.HTTP_200_OK)
-#             self.assertEqual(response.json()['state'], Game.STATE_QUESTION_WHIRLIGIG)
-#
-#             for question in item['questions']:
-#                 response = self.client.post(self.NEXT_STATE_URL, dict(token=game['token']))
-#                 self.assertEqual(response.status_code, status.HTTP_200_OK)
-#                 self.assertEqual(response.json()['state'], Game.STATE_QUESTION_START)
-#
-#                 response = self.client.post(self.NEXT_STATE_URL, dict(token=game['token']))
-#                 self.assertEqual(response.status_code, status.HTTP_200_OK)
-#                 self.assertEqual(response.json()['state'], Game.STATE_QUESTION_DISCUSSION)
-#
-#                 response = self.client.post(self.NEXT_STATE_URL, dict(token=game['token']))
-#                 self.assertEqual(response.status_code, status.HTTP_200_OK)
-#                 self.assertEqual(response.json()['state'], Game.STATE_QUESTION_END)
-#
-#                 response = self.client.post(self.NEXT_STATE_URL, dict(token=game['token']))
-#                 self.assertEqual(response.status_code, status.HTTP_200_OK)
-#                 self.assertTrue(response.json()['state'] in (Game.STATE_QUESTIONS, Game.STATE_END))
-#
-#         self.assertEqual(response.json()['state'], Game.STATE_END)
-#         for item_inner in response.json()['items']:
-#             self.assertTrue(item_inner['is_processed'])
-#             for question_inner in item_inner['questions']:
-#                 self.assertTrue(question_inner['is_processed'])
+    @staticmethod
+    def create_game(items_count):
+        game = Game.new()
+        for i in range(items_count):
+            item = GameItem.objects.create(game=game, number=i, name=str(i), type=GameItem.TYPE_BLITZ)
+            for j in range(3):
+                Question.objects.create(item=item, number=j, description='-', answer_description='-')
+        game.state = Game.STATE_QUESTION_START
+        game.cur_item = items_count - 1
+        game.cur_question = 2
+        game.save()
+        return game
 
+    def test_constant_query_count(self):
+        small_count, small_data = self.count_queries(self.create_game(1))
+        large_count, large_data = self.count_queries(self.create_game(13))
+        self.assertEqual(small_count, large_count)
+        self.assertEqual(len(large_data['items']), 13)
+        self.assertEqual(large_data['cur_item']['number'], 12)
+        self.assertEqual(large_data['cur_question']['number'], 2)
+
+    def test_missing_current_item(self):
+        game = self.create_game(1)
+        game.cur_item = 5
+        with self.assertRaises(BadStateException):
+            GameSerializer().to_representation(game)